@@ -1,33 +1,44 @@
-import json
-import pickle
-import random
+import os
+import subprocess
 import sys
-from multiprocessing import Pool, Value, cpu_count
-from statistics import mean, stdev
+from multiprocessing import Pool
 
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+import archive
+import configuration
 import ctrnn
 import line_location
 
 if len(sys.argv) < 6:
-    print("Usage: py ./animate.py config.json genome_name.pkl senderstart receiverstart goal")
+    print("Usage: py ./animate.py config.json genome_name.pkl senderstart receiverstart goal [out.mp4|out.gif|frames_dir] [workers]")
     exit()
 
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
+settings = configuration.load(sys.argv[1])
 
 simulation_seconds = settings.get("simulation_seconds",3)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+configuration.apply(settings)
+
+fps = 24
+# 2 second pause at the end
+pauseFrames = 48
 
 
 def runtrial(c, task):
+    """
+    Run a single trial
+
+    Return:
+        The sender and receiver positions after every step, and the final time
+    """
     sp, rp, goal = task
     sim = line_location.line_location(senderPos=sp,receiverPos=rp,goal=goal)
     time_const = line_location.line_location.timestep
 
-    sender = ctrnn.CTRNN(c,time_const)
-    receiver = ctrnn.CTRNN(c,time_const)
+    sender = ctrnn.CTRNN(c,time_const,settings.get("integrator","euler"))
+    receiver = ctrnn.CTRNN(c,time_const,settings.get("integrator","euler"))
 
     sender.reset()
     receiver.reset()
@@ -37,8 +48,8 @@ def runtrial(c, task):
     while sim.t < simulation_seconds:
         senderstate = sim.getState(True)
         receiverstate = sim.getState(False)
-        act1 = sender.eulerStep(senderstate)
-        act2 = receiver.eulerStep(receiverstate)
+        act1 = sender.step(senderstate)
+        act2 = receiver.step(receiverstate)
 
         senderOut = act1[0]
         receiverOut = act2[0]
@@ -46,56 +57,189 @@ def runtrial(c, task):
         sim.step(senderOut,receiverOut)
         sender_positions.append(sim.senderPos)
         receiver_positions.append(sim.receiverPos)
-        plt.figure()
-        plt.xlim(left=0,right=1.2)
-        plt.ylim(bottom=0,top=-300)
-        plt.xlabel("Position")
-        plt.ylabel("Time")
-        
-        plt.vlines(0.3,0,-300,colors='black',linestyles='dotted')
-        plt.vlines(goal,0,-300,colors='green',linestyles='dotted')
-
-        history_c = len(sender_positions)
-        history_ys = range(-history_c+1,1)
-        alphalist = [i/history_c for i in range(history_c)] if history_c != 0 else 1
-        
-        plt.scatter(sender_positions,history_ys,c="blue",alpha=alphalist) 
-        plt.scatter(receiver_positions,history_ys,c="orange",alpha=alphalist) 
-
-        plt.savefig(f"./frames/{sim.t}")
-        plt.close()
-        # print(sim.getAsciiState())
-        
-    # 2 second pause at the end
-    for i in range(1,49):
-        plt.figure()
-        plt.xlim(left=0,right=1.2)
-        plt.ylim(bottom=0,top=-300)
-        plt.xlabel("Position")
-        plt.ylabel("Time")
-
-        plt.vlines(0.3,-0.5,sim.t,colors='black',linestyles='dotted')
-        plt.vlines(goal,-0.5,sim.t,colors='green',linestyles='dotted')
-        
-        history_c = len(sender_positions)
-        history_ys = range(-history_c+1,1)
-
-        plt.plot(sender_positions,history_ys,c="blue") 
-        plt.plot(receiver_positions,history_ys,c="orange") 
-
-
-        plt.savefig(f"./frames/{sim.t+i}")
-        plt.close()
+    return np.array(sender_positions), np.array(receiver_positions), sim.t
+
+
+class Renderer():
+    """
+    Draws the frames of the animation of a trial on one figure that is built once.
+    The axes are drawn into a cached background, and each frame only restores the
+    background and draws the artists that move (blitting)
+
+    Parameters:
+        sender, receiver (np.array(float)) : The positions after every step
+        goal (float) : The goal position
+        end (float) : The final time of the trial
+    """
+    def __init__(self, sender, receiver, goal, end):
+        self.sender = sender
+        self.receiver = receiver
+        self.steps = len(sender)
+
+        self.fig = Figure()
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        ax = self.ax
+        ax.set_xlim(left=0,right=1.2)
+        ax.set_ylim(bottom=0,top=-300)
+        ax.set_xlabel("Position")
+        ax.set_ylabel("Time")
+
+        self.senderPoints = ax.scatter([],[],c="blue",animated=True)
+        self.receiverPoints = ax.scatter([],[],c="orange",animated=True)
+        self.senderLine, = ax.plot([],[],c="blue",animated=True)
+        self.receiverLine, = ax.plot([],[],c="orange",animated=True)
+
+        # One background while the trial runs, and one for the pause at the end
+        self.backgrounds = []
+        for bottom, top in ((0,-300), (-0.5,end)):
+            lines = [ax.vlines(0.3,bottom,top,colors='black',linestyles='dotted'),
+                     ax.vlines(goal,bottom,top,colors='green',linestyles='dotted')]
+            self.canvas.draw()
+            self.backgrounds.append(self.canvas.copy_from_bbox(self.fig.bbox))
+            for line in lines:
+                line.remove()
+
+    def __len__(self):
+        return self.steps + pauseFrames
+
+    @property
+    def size(self):
+        width, height = self.canvas.get_width_height()
+        return width, height
+
+    def palette(self):
+        """
+        Return:
+            A palette image for gifs, taken from the last frame of the trial, which
+            has every colour used by the animation
+        """
+        from PIL import Image
+        return Image.fromarray(self.frame(self.steps-1)).convert("RGB").quantize(256)
+
+    def frame(self, k):
+        """
+        Draw frame k
+
+        Return:
+            The frame as an RGBA array of shape (height, width, 4)
+        """
+        if k < self.steps:
+            count = k + 1
+            ys = np.arange(-count+1,1)
+            alpha = np.arange(count)/count
+            self.canvas.restore_region(self.backgrounds[0])
+            for artist, positions in ((self.senderPoints,self.sender), (self.receiverPoints,self.receiver)):
+                artist.set_offsets(np.column_stack([positions[:count],ys]))
+                artist.set_alpha(alpha)
+                self.ax.draw_artist(artist)
+        else:
+            ys = np.arange(-self.steps+1,1)
+            self.canvas.restore_region(self.backgrounds[1])
+            for artist, positions in ((self.senderLine,self.sender), (self.receiverLine,self.receiver)):
+                artist.set_data(positions,ys)
+                self.ax.draw_artist(artist)
+        return np.asarray(self.canvas.buffer_rgba())
+
+
+def write(frames, path, renderer, start=0, join=False):
+    """
+    Stream frames to path as they are drawn. Paths ending in .mp4 are piped to ffmpeg,
+    .gif files are written with Pillow, and anything else is a directory of numbered PNGs
+
+    Parameters:
+        frames (iterable) : RGBA arrays
+        path (str) : The output
+        renderer (Renderer) : The renderer drawing the frames
+        start (int) : The number of the first frame, used to name PNGs
+        join (bool) : For a gif, return the frames to be joined with other chunks rather than saving them
+
+    Return:
+        For a gif, the list of frames as palette images
+    """
+    from PIL import Image
+
+    if path.endswith(".mp4"):
+        width, height = renderer.size
+        ffmpeg = subprocess.Popen(["ffmpeg","-y","-loglevel","error","-f","rawvideo","-pix_fmt","rgba",
+                                   "-s",f"{width}x{height}","-r",str(fps),"-i","-",
+                                   "-vf","pad=ceil(iw/2)*2:ceil(ih/2)*2","-pix_fmt","yuv420p",path],
+                                  stdin=subprocess.PIPE)
+        for frame in frames:
+            ffmpeg.stdin.write(frame.tobytes())
+        ffmpeg.stdin.close()
+        if ffmpeg.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to write {path}")
+    elif path.endswith(".gif"):
+        # Every frame shares one palette, which is much faster than choosing a palette for each frame
+        palette = renderer.palette()
+        images = [Image.fromarray(frame).convert("RGB").quantize(palette=palette,dither=Image.Dither.NONE) for frame in frames]
+        if not join:
+            save_gif(images, path)
+        return images
+    else:
+        os.makedirs(path, exist_ok=True)
+        for i, frame in enumerate(frames):
+            Image.fromarray(frame).save(os.path.join(path,f"{start+i+1}.png"))
+
+
+def save_gif(images, path):
+    # The frames already share a palette, so skip the slow optimisation of each frame
+    images[0].save(path, save_all=True, append_images=images[1:], duration=1000/fps, loop=0, optimize=False)
+
+
+def render_chunk(sender, receiver, goal, end, start, stop, path):
+    """
+    Render frames start to stop in a worker process, into their own part of the output
+
+    Return:
+        See write
+    """
+    renderer = Renderer(sender, receiver, goal, end)
+    return write((renderer.frame(k) for k in range(start, stop)), path, renderer, start, join=True)
+
+
+def render(sender, receiver, goal, end, path, workers=1):
+    """
+    Render the animation of a trial to path, see write for the formats. With more than
+    one worker, contiguous chunks of frames are rendered in parallel and then joined
+
+    Parameters:
+        sender, receiver, goal, end : See Renderer
+        path (str) : The output
+        workers (int) : The number of processes used to draw frames
+    """
+    if workers <= 1:
+        renderer = Renderer(sender, receiver, goal, end)
+        write((renderer.frame(k) for k in range(len(renderer))), path, renderer)
+        return
+
+    total = len(sender) + pauseFrames
+    bounds = np.linspace(0, total, workers+1).astype(int)
+    parts = [f"{path}.part{i}.mp4" if path.endswith(".mp4") else path for i in range(workers)]
+    with Pool(processes=workers) as pool:
+        results = pool.starmap(render_chunk, [(sender, receiver, goal, end, bounds[i], bounds[i+1], parts[i]) for i in range(workers)])
+
+    if path.endswith(".mp4"):
+        listing = f"{path}.parts.txt"
+        with open(listing,'w') as f:
+            f.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+        subprocess.run(["ffmpeg","-y","-loglevel","error","-f","concat","-safe","0","-i",listing,"-c","copy",path], check=True)
+        for part in parts + [listing]:
+            os.remove(part)
+    elif path.endswith(".gif"):
+        save_gif([image for images in results for image in images], path)
 
 
 def main():
-    with open(sys.argv[2], 'rb') as f:
-        c = pickle.load(f)
+    c = archive.loadModel(sys.argv[2])
 
     task = (float(sys.argv[3]),float(sys.argv[4]),float(sys.argv[5]))
-    runtrial(c,task)
-    
-    
+    path = sys.argv[6] if len(sys.argv) > 6 else "./frames"
+    workers = int(sys.argv[7]) if len(sys.argv) > 7 else 1
+    sender, receiver, end = runtrial(c,task)
+    render(sender, receiver, task[2], end, path, workers)
+
+
 if __name__ == '__main__':
     main()
-    
\ No newline at end of file
@@ -0,0 +1,237 @@
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+
+import ctrnn
+
+# A binary archive holding many genomes in one file, which can be opened with np.memmap.
+# The file starts with a fixed header (headerType), followed by the JSON metadata for the
+# whole archive (such as the training config), padded with spaces to a multiple of 8 bytes.
+# The rest of the file is an array of fixed width records (recordType), one per genome,
+# so appending a genome only writes to the end of the file and updates the header count.
+
+magic = b"WAGGLEGA"
+version = 1
+
+headerType = np.dtype([("magic","S8"), ("version","<u4"), ("inputsCount","<u4"), ("hiddenCount","<u4"),
+                       ("outputsCount","<u4"), ("count","<u8"), ("metadataLength","<u8")])
+
+
+def recordType(inputsCount=3, hiddenCount=3):
+    """
+    The layout of a single genome in the archive. Unknown seeds and generations
+    are stored as -1, and unknown fitnesses as nan
+
+    Return:
+        A structured np.dtype
+    """
+    return np.dtype([("name","S32"), ("fitness","<f8"), ("seed","<i8"), ("generation","<i8"),
+                     ("vector","<f8",(ctrnn.vectorLength(inputsCount,hiddenCount),))])
+
+
+def isArchive(path):
+    """
+    Return:
+        True if the file at path starts with the archive magic bytes
+    """
+    with open(path,'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def create(path, inputsCount=3, hiddenCount=3, outputsCount=1, metadata=None):
+    """
+    Create an empty archive, overwriting path
+
+    Parameters:
+        path (str) : The file to be written
+        inputsCount, hiddenCount, outputsCount (int) : The layout of every genome in the archive
+        metadata (dict) : JSON serialisable information about the archive, e.g. the config
+    """
+    text = json.dumps(metadata or {}).encode()
+    text += b" " * (-len(text) % 8)
+    header = np.zeros((), dtype=headerType)
+    header["magic"] = magic
+    header["version"] = version
+    header["inputsCount"] = inputsCount
+    header["hiddenCount"] = hiddenCount
+    header["outputsCount"] = outputsCount
+    header["metadataLength"] = len(text)
+    with open(path,'wb') as f:
+        f.write(header.tobytes())
+        f.write(text)
+
+
+def readHeader(path):
+    """
+    Read the header and metadata of an archive
+
+    Return:
+        The header (np.void of headerType), the metadata (dict) and the offset of the first record
+    """
+    with open(path,'rb') as f:
+        header = np.frombuffer(f.read(headerType.itemsize), dtype=headerType).copy()[0]
+        if header["magic"] != magic:
+            raise ValueError(f"{path} is not a genome archive")
+        if header["version"] != version:
+            raise ValueError(f"{path} has archive version {header['version']}, expected {version}")
+        metadata = json.loads(f.read(int(header["metadataLength"])).decode())
+    return header, metadata, headerType.itemsize + int(header["metadataLength"])
+
+
+def append(path, genomes, names=None, fitnesses=None, seeds=None, generations=None):
+    """
+    Add genomes to the end of an archive
+
+    Parameters:
+        path (str) : The archive, which must already exist
+        genomes (list(Genome)) : The genomes, which must match the layout of the archive
+        names (list(str)) : A name for each genome, at most 32 bytes, or a ValueError is raised
+        fitnesses (list(float)), seeds (list(int)), generations (list(int)) : Optional information on each genome
+    """
+    header, _, offset = readHeader(path)
+    layout = (int(header["inputsCount"]), int(header["hiddenCount"]), int(header["outputsCount"]))
+    records = np.zeros(len(genomes), dtype=recordType(*layout[:2]))
+    records["fitness"] = np.nan
+    records["seed"] = -1
+    records["generation"] = -1
+    for i, genome in enumerate(genomes):
+        if (genome.inputsCount, genome.hiddenCount, genome.outputsCount) != layout:
+            raise ValueError(f"Genome {i} does not match the layout {layout} of {path}")
+        records["vector"][i] = genome.vector
+    if names is not None:
+        encoded = [name.encode() for name in names]
+        for name, raw in zip(names, encoded):
+            # Longer names would be cut short, so they could not be looked up or could collide
+            if len(raw) > records.dtype["name"].itemsize:
+                raise ValueError(f"The name {name} is longer than {records.dtype['name'].itemsize} bytes")
+        records["name"] = encoded
+    for field, values in (("fitness",fitnesses), ("seed",seeds), ("generation",generations)):
+        if values is not None:
+            records[field] = values
+
+    count = int(header["count"])
+    with open(path,'r+b') as f:
+        f.seek(offset + count * records.dtype.itemsize)
+        f.write(records.tobytes())
+        f.truncate()
+        # Only update the count once the records are written
+        header["count"] = count + len(genomes)
+        f.seek(0)
+        f.write(header.tobytes())
+
+
+def read(path, mode='r'):
+    """
+    Open an archive with np.memmap, so the records are only read from disk as they are used
+
+    Parameters:
+        path (str) : The archive
+        mode (str) : The np.memmap mode, 'r' or 'r+'
+
+    Return:
+        The header, the metadata and a structured array of records with fields
+        name, fitness, seed, generation and vector
+    """
+    header, metadata, offset = readHeader(path)
+    dtype = recordType(int(header["inputsCount"]), int(header["hiddenCount"]))
+    count = int(header["count"])
+    if count == 0:
+        return header, metadata, np.zeros(0, dtype=dtype)
+    return header, metadata, np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(count,))
+
+
+def genomes(path):
+    """
+    Load every genome in an archive. The genomes are views of the memory mapped file,
+    so use Genome.copy before changing them
+
+    Return:
+        A list of (name, Genome) tuples
+    """
+    header, _, records = read(path)
+    layout = (int(header["inputsCount"]), int(header["hiddenCount"]), int(header["outputsCount"]))
+    return [(record["name"].decode(), ctrnn.Genome.fromVector(records["vector"][i], *layout))
+            for i, record in enumerate(records)]
+
+
+def loadModels(spec):
+    """
+    Load the models named by spec, which is either a pickled genome, an archive, or
+    an archive followed by :name or :index to pick genomes from it
+
+    Return:
+        A list of (name, Genome) tuples
+    """
+    path, selector = spec, None
+    if not os.path.exists(spec) and ":" in spec:
+        path, selector = spec.rsplit(":",1)
+
+    if not isArchive(path):
+        with open(path,'rb') as f:
+            return [(os.path.splitext(os.path.basename(path))[0], pickle.load(f))]
+
+    models = genomes(path)
+    if selector is None:
+        return models
+    selected = [model for model in models if model[0] == selector]
+    if not selected and selector.isdigit() and int(selector) < len(models):
+        selected = [models[int(selector)]]
+    if not selected:
+        raise KeyError(f"No genome named {selector} in {path}")
+    return selected
+
+
+def loadModel(spec):
+    """
+    Load a single genome, see loadModels for the form of spec
+
+    Return:
+        A Genome object
+    """
+    models = loadModels(spec)
+    if len(models) != 1:
+        raise ValueError(f"{spec} contains {len(models)} genomes, pick one with path:name or path:index")
+    return models[0][1]
+
+
+def convert(out, paths):
+    """
+    Append pickled genomes to an archive, creating it if needed. Each genome is named
+    after its file
+
+    Parameters:
+        out (str) : The archive to be written
+        paths (list(str)) : The pickled genomes
+    """
+    models = []
+    for path in paths:
+        with open(path,'rb') as f:
+            models.append((os.path.splitext(os.path.basename(path))[0], pickle.load(f)))
+    if not os.path.exists(out):
+        first = models[0][1]
+        create(out, first.inputsCount, first.hiddenCount, first.outputsCount)
+    append(out, [genome for _, genome in models], names=[name for name, _ in models])
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("convert", "list"):
+        print("Usage: py ./archive.py convert archive.wgl genome.pkl [genome.pkl ...]")
+        print("       py ./archive.py list archive.wgl")
+        exit()
+
+    if sys.argv[1] == "convert":
+        convert(sys.argv[2], sys.argv[3:])
+        print(f"Added {len(sys.argv)-3} genomes to {sys.argv[2]}")
+    else:
+        header, metadata, records = read(sys.argv[2])
+        print(f"{int(header['count'])} genomes, layout {header['inputsCount']}-{header['hiddenCount']}-{header['outputsCount']}")
+        if metadata:
+            print(f"Metadata: {json.dumps(metadata)}")
+        for i, record in enumerate(records):
+            print(f"{i:4d} {record['name'].decode():32s} fitness:{record['fitness']:.3f} seed:{record['seed']} generation:{record['generation']}")
+
+if __name__ == '__main__':
+    main()
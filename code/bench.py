@@ -0,0 +1,177 @@
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from multiprocessing import cpu_count
+from statistics import mean, median, stdev
+
+import numpy as np
+
+# The benchmark suite. Every hot path, from a single CTRNN.eulerStep up to a whole
+# generation, evaluate.py and the meandistance sweep, is timed for every config in
+# configurations/, and the results are written as JSON so two runs can be compared.
+# Each config runs in its own interpreter, so nothing set up for one config can affect
+# the timings of the next.
+# Usage: py ./bench.py run [results.json] [config.json ...]
+#        py ./bench.py compare baseline.json results.json [tolerance]
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+repeats = 5
+
+
+def timeit(function, repeat=repeats, number=1):
+    """
+    Time function after one warm up call, which also compiles any numba kernels
+
+    Parameters:
+        function (func) : Called with no arguments
+        repeat (int) : The number of samples
+        number (int) : The number of calls in each sample
+
+    Return:
+        A dict of the median, min, mean and standard deviation of the time of one call, in seconds
+    """
+    function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return {"median" : median(samples), "min" : min(samples), "mean" : mean(samples),
+            "stdev" : stdev(samples) if len(samples) > 1 else 0.0, "repeat" : repeat, "number" : number}
+
+
+def model():
+    """
+    Return:
+        The path of the first saved model, used by evaluate and meandistance
+    """
+    return sorted(glob.glob(os.path.join(root, "models", "*.pkl")))[0]
+
+
+def bench_config(path):
+    """
+    Run every benchmark for one config, in this interpreter
+
+    Return:
+        A dict of the timings of each benchmark, see timeit
+    """
+    import archive
+    import ctrnn
+    import evaluate
+    import evolve
+    import rollout
+    import sweep
+    import train
+
+    train.configure(path)
+    random.seed(0)
+    np.random.seed(0)
+    genome = archive.loadModel(model())
+    results = {}
+
+    network = ctrnn.CTRNN(genome, train.time_const)
+    inputs = np.random.uniform(0, 1, genome.inputsCount)
+    results["eulerStep"] = timeit(lambda: network.eulerStep(inputs), number=10000)
+    task = train.make_trials(0.5)[0]
+    results["trial"] = timeit(lambda: rollout.rollout(genome, task, train.settings), number=10)
+    results["fitness"] = timeit(lambda: train.fitness(genome, 0.5))
+
+    with train.make_pool() as pool:
+        pop = evolve.assess(evolve.initialise(train.population_size), pool, train.fitness, 0.5)
+
+        def generation():
+            # The same steps as one generation of train.train
+            rs = random.random()
+            if train.batched:
+                parents = evolve.assess_batch(pop, pool, train.batch_fitness, rs)
+                evolve.mutate_batch(evolve.sus(parents), pool, train.batch_fitness, rs)
+            else:
+                parents = evolve.assess(pop, pool, train.fitness, rs)
+                evolve.mutate(evolve.sus(parents), pool, train.fitness, rs)
+        results["generation"] = timeit(generation, repeat=3)
+
+        goals = np.arange(0.5,1,0.01)
+        starts = np.arange(0,0.3,0.03)
+        results["meandistance"] = timeit(lambda: sweep.sweep(genome, train.settings, {"goal" : goals, "sender" : starts, "receiver" : starts}, pool=pool), repeat=3)
+
+    results["evaluate"] = timeit(lambda: evaluate.evaluate(genome, train.settings, 2500), repeat=3)
+    return results
+
+
+def run(out, configs):
+    """
+    Benchmark each config in its own process and write the results to out
+    """
+    results = {}
+    for path in configs:
+        name = os.path.splitext(os.path.basename(path))[0]
+        print(f"Benchmarking {name}")
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "config", path], capture_output=True, text=True, cwd=root)
+        if child.returncode != 0:
+            raise RuntimeError(f"Benchmarking {path} failed:\n{child.stderr}")
+        results[name] = json.loads(child.stdout.splitlines()[-1])
+        for bench, timing in results[name].items():
+            print(f"\t{bench:14s} {timing['median']:.3e}s")
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=root).stdout.strip()
+    except OSError:
+        commit = None
+    info = {"time" : time.time(), "commit" : commit, "python" : platform.python_version(), "numpy" : np.__version__,
+            "platform" : platform.platform(), "cpus" : cpu_count()}
+    with open(out,'w') as f:
+        json.dump({"info" : info, "results" : results}, f, indent=1)
+    print(f"Results are in {out}")
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Print the change in the median time of every benchmark found in both files, flagging
+    any that are more than tolerance slower
+
+    Return:
+        The number of regressions
+    """
+    with open(baseline,'r') as f:
+        old = json.load(f)["results"]
+    with open(current,'r') as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(old.keys() & new.keys()):
+        print(name)
+        for bench in sorted(old[name].keys() & new[name].keys()):
+            before, after = old[name][bench]["median"], new[name][bench]["median"]
+            ratio = after / before
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "REGRESSION"
+                regressions += 1
+            elif ratio < 1 - tolerance:
+                flag = "faster"
+            print(f"\t{bench:14s} {before:.3e}s -> {after:.3e}s {ratio:6.2f}x {flag}")
+    print(f"{regressions} regressions beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("run", "compare", "config"):
+        print("Usage: py ./bench.py run [results.json] [config.json ...]\n       py ./bench.py compare baseline.json results.json [tolerance]")
+        exit()
+    if sys.argv[1] == "config":
+        print(json.dumps(bench_config(sys.argv[2])))
+    elif sys.argv[1] == "run":
+        out = sys.argv[2] if len(sys.argv) > 2 else f"bench_{int(time.time())}.json"
+        configs = [os.path.abspath(path) for path in sys.argv[3:]] or sorted(glob.glob(os.path.join(root, "configurations", "*.json")))
+        run(out, configs)
+    else:
+        tolerance = float(sys.argv[4]) if len(sys.argv) > 4 else 0.1
+        exit(1 if compare(sys.argv[2], sys.argv[3], tolerance) else 0)
+
+if __name__ == '__main__':
+    main()
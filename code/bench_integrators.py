@@ -0,0 +1,78 @@
+import glob
+import sys
+import time
+
+import numpy as np
+from scipy.stats import spearmanr
+
+import archive
+import configuration
+import ctrnn
+import evolve
+import sweep
+
+# Compare the integrators and timesteps on accuracy against cost. Every scheme runs the
+# same random trials for a population of the saved models and random genomes, and is
+# measured against Euler with a timestep of 1, which evolution has always used, on the
+# final distance from the goal, the time taken and how well it keeps the ranking of the
+# genomes by the aggregate fitness training selects on.
+# Usage: py ./bench_integrators.py config.json [ntrials] [random_genomes]
+
+timesteps = [1, 2, 5, 10]
+
+
+def population(randomCount):
+    """
+    Return:
+        The models in models/ and randomCount random genomes
+    """
+    genomes = [archive.loadModel(path) for path in sorted(glob.glob("models/*.pkl"))]
+    return genomes + [ctrnn.Genome() for _ in range(randomCount)]
+
+
+def run(genomes, tasks, settings, integrator, timestep):
+    """
+    Run every genome on every task
+
+    Return:
+        Arrays of shape (genomes, tasks) of the final distance from the goal and the
+        fitness, and the wall clock time
+    """
+    sp, rp, goal = tasks.T
+    start = time.time()
+    out = sweep.simulate(genomes, sp, rp, goal, np.array([settings.get("simulation_seconds",3)],dtype=np.float64),
+                         settings.get("motor","clippedMotor1"), integrator, timestep)
+    elapsed = time.time() - start
+    return out["distance"][...,0], out["fitness"][...,0], elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: py ./bench_integrators.py config.json [ntrials] [random_genomes]")
+        exit()
+    settings = configuration.load(sys.argv[1])
+    configuration.apply(settings)
+    ntrials = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    randomCount = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    np.random.seed(settings.get("seed", 0))
+    genomes = population(randomCount)
+    tasks = np.column_stack([np.random.uniform(0,0.3,ntrials), np.random.uniform(0,0.3,ntrials), np.random.uniform(0.5,1.0,ntrials)])
+    print(f"{len(genomes)} genomes, {ntrials} trials, {settings.get('simulation_seconds',3)} seconds")
+
+    refDistance, refFitness, refTime = run(genomes, tasks, settings, "euler", 1)
+    refScores = evolve.rank_reduce_batch(refFitness)
+    top = max(1, len(genomes) // 10)
+    refTop = set(np.argsort(-refScores)[:top])
+    print(f"{'integrator':12s} {'timestep':>8s} {'time':>8s} {'speedup':>8s} {'distance error':>15s} {'rank corr':>10s} {'top 10%':>8s}")
+    for integrator in ctrnn.integrators:
+        for timestep in timesteps:
+            distance, fitness, elapsed = run(genomes, tasks, settings, integrator, timestep)
+            scores = evolve.rank_reduce_batch(fitness)
+            error = np.mean(np.abs(distance - refDistance))
+            correlation = spearmanr(scores, refScores)[0]
+            agreement = len(refTop & set(np.argsort(-scores)[:top])) / top
+            print(f"{integrator:12s} {timestep:8g} {elapsed:7.2f}s {refTime/elapsed:7.1f}x {error:15.4f} {correlation:10.3f} {agreement:8.0%}")
+
+if __name__ == '__main__':
+    main()
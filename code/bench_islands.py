@@ -0,0 +1,81 @@
+import io
+import sys
+import time
+
+import numpy as np
+
+import islands
+import train
+
+# Compare the island model with a single population trained by train.train, on the
+# generations and genome evaluations needed to reach a target fitness and the wall clock
+# time. Unless "island_size" is set, the islands share the single population's size
+# between them, so both evaluate the same number of genomes every generation.
+# Usage: py ./bench_islands.py config.json [target_fitness]
+
+
+def generations_to(history, target):
+    """
+    Return:
+        The first generation whose best fitness reaches target, or None
+    """
+    reached = np.nonzero(np.asarray(history) >= target)[0]
+    return int(reached[0]) if len(reached) else None
+
+
+def evaluations_to(generation, size):
+    """
+    Return:
+        The number of genome evaluations made up to and including generation, for a
+        population of size which is assessed and mutated every generation, or None
+    """
+    return None if generation is None else 2 * size * (generation + 1)
+
+
+def single():
+    """
+    Train a single population with train.train
+
+    Return:
+        The best fitness of each generation and the wall clock time
+    """
+    log = io.StringIO()
+    start = time.time()
+    train.train(train.population_size, train.generations, file=log)
+    elapsed = time.time() - start
+    history = [float(line.split("max:")[1].split(",")[0]) for line in log.getvalue().splitlines() if "Fitness  :" in line]
+    return history, elapsed
+
+
+def island_model():
+    """
+    Train with islands.run
+
+    Return:
+        The best fitness across the islands of each generation and the wall clock time
+    """
+    start = time.time()
+    results = islands.run(islands.islands, islands.island_size, train.generations)
+    elapsed = time.time() - start
+    return list(np.max([r[0] for r in results], axis=0)), elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: py ./bench_islands.py config.json [target_fitness]")
+        exit()
+    islands.configure(sys.argv[1])
+    if "island_size" not in train.settings:
+        islands.island_size = train.population_size // islands.islands
+        islands.check(islands.island_size, islands.migrants)
+    target = float(sys.argv[2]) if len(sys.argv) > 2 else train.settings.get("target_fitness", 0.9)
+    print(f"Target fitness {target}, {train.generations} generations, seed {train.seed}")
+    for name, size, run in (("single", train.population_size, single),
+                            (f"{islands.islands} islands ({islands.topology})", islands.islands * islands.island_size, island_model)):
+        history, elapsed = run()
+        generation = generations_to(history, target)
+        print(f"{name:24s} population:{size:5d} generations to target:{generation} "
+              f"evaluations to target:{evaluations_to(generation, size)} best:{max(history):.3f} time:{elapsed:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import pickle
+import queue
+import random
+import threading
+
+import numpy as np
+
+import ctrnn
+import evolve
+
+
+class OutOfTime(Exception):
+    """
+    Raised by training once it has checkpointed because the time budget is nearly used up
+    """
+
+
+class Checkpointer():
+    """
+    Writes checkpoints on a background thread, so training never waits on the disk.
+    If a checkpoint is still waiting to be written when a newer one arrives, only the
+    newer one is written
+
+    Parameters:
+        path (str) : The file the checkpoints are written to
+        info (dict) : Added to every checkpoint, e.g. the seed and start time of the run
+    """
+    def __init__(self, path, info=None):
+        self.path = path
+        self.info = info or {}
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            state = self.queue.get()
+            if state is None:
+                return
+            write(self.path, {**self.info, **state})
+
+    def save(self, state):
+        """
+        Queue a checkpoint to be written, replacing any that has not been written yet
+
+        Parameters:
+            state (dict) : A checkpoint made by snapshot
+        """
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put(state)
+
+    def close(self):
+        """
+        Wait for the last checkpoint to be written and stop the thread
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write(path, state):
+    """
+    Atomically write a checkpoint. It is written to a temporary file first and then
+    renamed, so a crash part way through never leaves a broken checkpoint behind
+
+    Parameters:
+        path (str) : The checkpoint file
+        state (dict) : A checkpoint made by snapshot
+    """
+    tmp = path + ".tmp"
+    with open(tmp,'wb') as f:
+        pickle.dump(state,f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp,path)
+
+
+def load(path):
+    """
+    Return:
+        The checkpoint stored at path
+    """
+    with open(path,'rb') as f:
+        return pickle.load(f)
+
+
+def snapshot(pop, best, **progress):
+    """
+    Copy everything needed to carry on training, so that it can be written while training continues
+
+    Parameters:
+        pop (list) : The population
+        best (Citizen) : The best member seen so far
+        progress : Anything else to be restored, e.g. the generation and mutation counts
+
+    Return:
+        A dict holding the population, the best member, both random number generator
+        states and progress
+    """
+    genome = pop[0].genome
+    return {"layout" : (genome.inputsCount, genome.hiddenCount, genome.outputsCount),
+            "genomes" : ctrnn.stackGenomes([x.genome for x in pop]),
+            "fitness" : [x.fitness for x in pop],
+            "age" : [x.age for x in pop],
+            "best" : None if best is None else (best.genome.vector.copy(), best.fitness, best.age),
+            "random" : random.getstate(),
+            "nprandom" : np.random.get_state(),
+            **progress}
+
+
+def restore(state):
+    """
+    Rebuild the population and best member from a checkpoint, and restore the random number generators
+
+    Parameters:
+        state (dict) : A checkpoint made by snapshot
+
+    Return:
+        The population and the best member seen so far
+    """
+    layout = state["layout"]
+    pop = [evolve.Citizen(ctrnn.Genome.fromVector(vector.copy(), *layout), fitness, age)
+           for vector, fitness, age in zip(state["genomes"], state["fitness"], state["age"])]
+    best = None
+    if state["best"] is not None:
+        vector, fitness, age = state["best"]
+        best = evolve.Citizen(ctrnn.Genome.fromVector(vector, *layout), fitness, age)
+    random.setstate(state["random"])
+    np.random.set_state(state["nprandom"])
+    return pop, best
@@ -0,0 +1,33 @@
+import json
+
+import line_location
+
+# Loading settings, and setting up the simulation of a process from them. Nothing is
+# read from the command line here, so settings can be built and reused from Python.
+
+
+def load(config):
+    """
+    Parameters:
+        config (dict or str) : The settings, or the path of a JSON file holding them
+
+    Return:
+        The settings as a dict
+    """
+    if isinstance(config, dict):
+        return config
+    with open(config,'r') as f:
+        return json.load(f)
+
+
+def apply(settings):
+    """
+    Set the motor function and timestep of line_location in this process. Pools are given
+    this as their initializer, so that workers are set up the same way whether they are
+    forked or spawned
+
+    Parameters:
+        settings (dict) : The settings, read for motor and timestep
+    """
+    line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+    line_location.line_location.timestep = settings.get("timestep",1)
@@ -4,6 +4,10 @@ from scipy.special import expit
 def sigmoid(x):
     return 1/(1 + np.exp(-x))
 
+# The ways of integrating the networks, and the method of CTRNN and BatchCTRNN that uses each.
+# Euler is the reference. Exponential Euler solves the decay of each state exactly with the
+# inputs held over the step, so it stays stable for timesteps near tau, and RK4 is fourth order
+integrators = {"euler" : "eulerStep", "exponential" : "exponentialStep", "rk4" : "rk4Step"}
 
 
 class CTRNN():
@@ -12,9 +16,11 @@ class CTRNN():
 
     Parameters:
         genome (Genome)
+        timestep (float) : The change in time for each step
+        integrator (str) : The integrator used by step, one of integrators
     """
     
-    def __init__(self, genome=None,timestep=1):
+    def __init__(self, genome=None,timestep=1,integrator="euler"):
         if genome == None:
             genome = Genome()
         self.inputsCount   = genome.inputsCount
@@ -28,6 +34,9 @@ class CTRNN():
         self.outputs       = expit((self.states + self.biases))
         self.rTaus         = genome.rTaus
         self.sTaus         = self.rTaus * timestep
+        self.timestep      = timestep
+        self.decay         = np.exp(-self.sTaus)
+        self.step          = getattr(self, integrators[integrator])
 
     def eulerStep(self,externalInputs):
         """
@@ -52,6 +61,37 @@ class CTRNN():
         # We can now calculate the external output. 
         self.outputs = expit((self.states + self.biases)) 
         return self.outputs[:self.outputCount] 
+
+    def exponentialStep(self,externalInputs):
+        """
+        The same as eulerStep, but each state decays exactly towards its input over
+        the timestep, s = delta + (s - delta) * exp(-timestep/tau)
+        """
+        self.paddedInputs[:self.inputsCount] = externalInputs
+        delta = np.multiply(self.paddedInputs, self.inputWeights) + np.dot(self.outputs, self.weights)
+        self.states = delta + (self.states - delta) * self.decay
+        self.outputs = expit((self.states + self.biases))
+        return self.outputs[:self.outputCount]
+
+    def rk4Step(self,externalInputs):
+        """
+        The same as eulerStep, but with the classic fourth order Runge-Kutta method,
+        holding the external inputs fixed over the timestep
+        """
+        self.paddedInputs[:self.inputsCount] = externalInputs
+        external = np.multiply(self.paddedInputs, self.inputWeights)
+
+        def derivative(states):
+            return (external + np.dot(expit(states + self.biases), self.weights) - states) * self.rTaus
+
+        h = self.timestep
+        k1 = derivative(self.states)
+        k2 = derivative(self.states + h/2 * k1)
+        k3 = derivative(self.states + h/2 * k2)
+        k4 = derivative(self.states + h * k3)
+        self.states = self.states + h/6 * (k1 + 2*k2 + 2*k3 + k4)
+        self.outputs = expit((self.states + self.biases))
+        return self.outputs[:self.outputCount]
     
     def reset(self):
         """
@@ -82,11 +122,185 @@ class CTRNN():
         self.states  = states
         self.outputs = expit((self.states + self.biases))
 
+class BatchCTRNN():
+    """
+    Class implementing many CTRNNs that are advanced together in a single vectorized step.
+    Every genome is run in parallel for each element of the batch shape, so for a
+    population evaluated over ntrials trials with a sender and a receiver the states
+    have shape (genomes, ntrials, 2, hiddenCount)
+
+    Parameters:
+        genomes (List(Genome)) : The genomes to be run, all with the same layout
+        shape (tuple(int)) : The extra batch axes that each genome is repeated over
+        timestep (float) : The change in time for each step
+        integrator (str) : The integrator used by step, one of integrators
+    """
+
+    def __init__(self, genomes, shape=(), timestep=1, integrator="euler"):
+        first = genomes[0]
+        for genome in genomes:
+            assert((genome.inputsCount,genome.hiddenCount,genome.outputsCount) ==
+                   (first.inputsCount,first.hiddenCount,first.outputsCount))
+        self.inputsCount  = first.inputsCount
+        self.outputCount  = first.outputsCount
+        self.hiddenCount  = first.hiddenCount
+        self.shape        = (len(genomes),) + tuple(shape) + (self.hiddenCount,)
+
+        # Parameters are stored once per genome, with a middle axis to broadcast over the batch
+        matrix = stackGenomes(genomes)
+        w = self.inputsCount + self.hiddenCount*self.hiddenCount
+        self.inputWeights = matrix[:,None,:self.inputsCount]
+        self.weights      = matrix[:,self.inputsCount:w].reshape((-1,self.hiddenCount,self.hiddenCount))
+        self.biases       = matrix[:,None,w:w+self.hiddenCount]
+        self.rTaus        = np.reciprocal(matrix[:,None,w+self.hiddenCount:])
+        self.sTaus        = self.rTaus * timestep
+        self.timestep     = timestep
+        self.decay        = np.exp(-self.sTaus)
+        self.step         = getattr(self, integrators[integrator])
+
+        self.states  = np.zeros(self.shape)
+        self.outputs = np.empty(self.shape)
+        self.delta   = np.empty(self.shape)
+        self.reset()
+
+    def _flat(self, array):
+        """
+        View a batch array as (genomes, batch, hiddenCount), which is the layout used for the maths
+        """
+        return array.reshape(self.shape[0],-1,self.hiddenCount)
+
+    def eulerStep(self, externalInputs):
+        """
+        Advance every network in the batch by one timestep
+
+        Parameters:
+            externalInputs (np.array(float)) : The inputs to each network, shape =
+                                               (genomes, *shape, inputsCount)
+
+        Return:
+            The outputs of every network at this timestep, shape = (genomes, *shape, outputCount)
+        """
+        states  = self._flat(self.states)
+        outputs = self._flat(self.outputs)
+        delta   = self._flat(self.delta)
+        inputs  = np.reshape(externalInputs,(self.shape[0],-1,self.inputsCount))
+
+        # Recurrent input for every network, then the external inputs to the first hidden nodes
+        np.matmul(outputs, self.weights, out=delta)
+        delta[:,:,:self.inputsCount] += inputs * self.inputWeights[:,:,:self.inputsCount]
+
+        # Update the states in place
+        delta -= states
+        delta *= self.sTaus
+        states += delta
+
+        np.add(states, self.biases, out=outputs)
+        expit(outputs, out=outputs)
+        return self.outputs[...,:self.outputCount]
+
+    def exponentialStep(self, externalInputs):
+        """
+        The same as eulerStep, but each state decays exactly towards its input over
+        the timestep, s = delta + (s - delta) * exp(-timestep/tau)
+        """
+        states  = self._flat(self.states)
+        outputs = self._flat(self.outputs)
+        delta   = self._flat(self.delta)
+        inputs  = np.reshape(externalInputs,(self.shape[0],-1,self.inputsCount))
+
+        np.matmul(outputs, self.weights, out=delta)
+        delta[:,:,:self.inputsCount] += inputs * self.inputWeights[:,:,:self.inputsCount]
+
+        states -= delta
+        states *= self.decay
+        states += delta
+
+        np.add(states, self.biases, out=outputs)
+        expit(outputs, out=outputs)
+        return self.outputs[...,:self.outputCount]
+
+    def rk4Step(self, externalInputs):
+        """
+        The same as eulerStep, but with the classic fourth order Runge-Kutta method,
+        holding the external inputs fixed over the timestep
+        """
+        states = self._flat(self.states)
+        inputs = np.reshape(externalInputs,(self.shape[0],-1,self.inputsCount))
+        external = np.zeros(states.shape)
+        external[:,:,:self.inputsCount] = inputs * self.inputWeights[:,:,:self.inputsCount]
+
+        def derivative(s):
+            return (external + np.matmul(expit(s + self.biases), self.weights) - s) * self.rTaus
+
+        h = self.timestep
+        k1 = derivative(states)
+        k2 = derivative(states + h/2 * k1)
+        k3 = derivative(states + h/2 * k2)
+        k4 = derivative(states + h * k3)
+        states += h/6 * (k1 + 2*k2 + 2*k3 + k4)
+
+        outputs = self._flat(self.outputs)
+        np.add(states, self.biases, out=outputs)
+        expit(outputs, out=outputs)
+        return self.outputs[...,:self.outputCount]
+
+    def reset(self):
+        """
+        Set the internal states of every network to 0
+        """
+        self.states[...] = 0
+        self.setStates(self.states)
+
+    def setStates(self,states):
+        """
+        Set the internal states of the networks to fixed values given in states
+
+        Parameters:
+            states (array of floats) - must broadcast to the shape of the batch states
+        """
+        self.states[...] = states
+        np.add(self._flat(self.states), self.biases, out=self._flat(self.outputs))
+        expit(self.outputs, out=self.outputs)
+
+    def trajectory(self, externalInputs, steps, every=1, keep=None, out=None):
+        """
+        Integrate every network for a number of steps with fixed inputs, recording the
+        states into a preallocated array. The current states are the first record
+
+        Parameters:
+            externalInputs (np.array(float)) : The inputs to each network, broadcast to
+                                               (genomes, *shape, inputsCount)
+            steps (int) : The number of steps to take
+            every (int) : Only record the states every this many steps
+            keep (int) : If given, only the last keep records are kept, in a ring buffer
+            out (np.array(float)) : An optional array to record into, of shape (records, genomes, *shape, hiddenCount)
+
+        Return:
+            The recorded states in time order, shape = (records, genomes, *shape, hiddenCount)
+        """
+        inputs = np.broadcast_to(externalInputs, self.shape[:-1] + (self.inputsCount,))
+        records = steps // every + 1
+        size = records if keep is None else min(keep, records)
+        if out is None:
+            out = np.empty((size,) + self.shape)
+        assert(out.shape == (size,) + self.shape)
+
+        out[0] = self.states
+        for step in range(1, steps+1):
+            self.step(inputs)
+            if step % every == 0:
+                out[(step // every) % size] = self.states
+        if size < records:
+            out[...] = np.roll(out, -(records % size), axis=0)
+        return out
+
 class Genome():
     """
     The genotype of a CTRNN. This will be the target of the genetic algorithm.
     For these networks all of the hidden nodes are fully connected to eachother, 
-    and can connect to up to one input node and up to one output node
+    and can connect to up to one input node and up to one output node.
+    All of the parameters are stored in one contiguous vector, in the order input weights,
+    weights, biases and taus, and the named attributes are views of it
 
     Parameters:
         inputsCount (int) : The number of external inputs to the network, < hiddenCount
@@ -101,13 +315,11 @@ class Genome():
         centerCrossing (bool)      : Determine if the CTRNN should be center crossing
 
     """
+    __slots__ = ("inputsCount", "hiddenCount", "outputsCount", "size", "vector", "rTaus", "_views")
+
     def __init__(self,inputsCount=3,hiddenCount=3,outputsCount=1,iWeights=None,weights=None,
                 biases=None, taus=None, centerCrossing = False):
-        # Weights = 2D array 
-        self.inputsCount  = inputsCount
-        self.hiddenCount  = hiddenCount
-        self.outputsCount = outputsCount
-        self.size = inputsCount + hiddenCount + outputsCount
+        self._layout(inputsCount, hiddenCount, outputsCount, np.empty(vectorLength(inputsCount,hiddenCount)))
 
         # Each input/output is connected to exactly one hidden node
         if iWeights is None:
@@ -125,7 +337,7 @@ class Genome():
         self.weights = weights
 
         if centerCrossing == True:
-            biases = -0.5 * sum(weights)
+            biases = -0.5 * sum(self.weights)
         elif biases is None: 
             # biases = np.random.normal(scale=2,size=(hiddenCount)) 
             biases = np.random.uniform(-16,16,size=(hiddenCount))
@@ -137,8 +349,61 @@ class Genome():
             # taus = np.ones((hiddenCount))
             taus = np.random.uniform(50,100,(hiddenCount))
         self.taus = taus
-        self.rTaus = np.reciprocal(self.taus)
 
+    def _layout(self, inputsCount, hiddenCount, outputsCount, vector):
+        """
+        Set the counts and create the named views of vector. rTaus is left to be filled in
+        """
+        self.inputsCount  = inputsCount
+        self.hiddenCount  = hiddenCount
+        self.outputsCount = outputsCount
+        self.size = inputsCount + hiddenCount + outputsCount
+        self.vector = vector
+        w = inputsCount + hiddenCount*hiddenCount
+        self._views = (vector[:inputsCount], vector[inputsCount:w].reshape((hiddenCount,hiddenCount)),
+                       vector[w:w+hiddenCount], vector[w+hiddenCount:w+2*hiddenCount])
+        self.rTaus = np.empty(hiddenCount)
+
+    @property
+    def inputWeights(self):
+        return self._views[0]
+
+    @inputWeights.setter
+    def inputWeights(self, value):
+        self._views[0][...] = value
+
+    @property
+    def weights(self):
+        return self._views[1]
+
+    @weights.setter
+    def weights(self, value):
+        self._views[1][...] = value
+
+    @property
+    def biases(self):
+        return self._views[2]
+
+    @biases.setter
+    def biases(self, value):
+        self._views[2][...] = value
+
+    @property
+    def taus(self):
+        return self._views[3]
+
+    @taus.setter
+    def taus(self, value):
+        self._views[3][...] = value
+        np.reciprocal(self._views[3], out=self.rTaus)
+
+    def _clip(self):
+        """
+        Clip every parameter to its range and update rTaus
+        """
+        _, lower, upper = parameterRanges(self.inputsCount, self.hiddenCount)
+        np.clip(self.vector, lower, upper, out=self.vector)
+        np.reciprocal(self.taus, out=self.rTaus)
 
     # Recreate the beer version
     def mutate(self, stddev):
@@ -148,38 +413,22 @@ class Genome():
         Parameters:
             stddev (float) : The standard deviation of the gaussian distribution to be drawn upon
         """
-        self.inputWeights  += np.random.normal(0,stddev,self.inputWeights.shape)
-        self.outputWeights += np.random.normal(0,stddev,self.outputWeights.shape)
-        self.weights       += np.random.normal(0,stddev,self.weights.shape)
-        self.biases        += np.random.normal(0,stddev,self.biases.shape)
-        self.taus          += np.random.normal(0,stddev,self.taus.shape)
-
-        
-        self.inputWeights   = np.clip(self.inputWeights,-16,16)
-        self.weights        = np.clip(self.weights,-16,16)
-        self.biases         = np.clip(self.biases,-16,16)
-        self.taus           = np.clip(self.taus,50,100)
-        self.rTaus          = np.reciprocal(self.taus)
+        self.vector += np.random.normal(0,stddev,self.vector.shape)
+        self._clip()
 
     def beerMutate(self, stddev):
         """
         Perform mutation as described by Randall Beer
         """
         magnitude = np.random.normal(0,stddev)
-        mutationvector = np.random.normal(0,1,self.inputsCount+(self.hiddenCount*self.hiddenCount)+(2*self.hiddenCount))
+        mutationvector = np.random.normal(0,1,len(self.vector))
         mutationvector /= np.sqrt((mutationvector**2).sum(-1))
         mutationvector *= magnitude
 
-        self.inputWeights  += 16 * mutationvector[:self.inputsCount]
-        self.weights       += 16 * mutationvector[self.inputsCount:self.inputsCount+(self.hiddenCount*self.hiddenCount)].reshape((self.hiddenCount,self.hiddenCount))
-        self.biases        += 16 * mutationvector[self.inputsCount+(self.hiddenCount*self.hiddenCount):self.inputsCount+(self.hiddenCount*self.hiddenCount)+self.hiddenCount]
-        self.taus          += 25 * mutationvector[self.inputsCount+(self.hiddenCount*self.hiddenCount)+(self.hiddenCount):self.inputsCount+(self.hiddenCount*self.hiddenCount)+2*(self.hiddenCount)]
-
-        self.inputWeights   = np.clip(self.inputWeights,-16,16)
-        self.weights        = np.clip(self.weights,-16,16)
-        self.biases         = np.clip(self.biases,-16,16)
-        self.taus           = np.clip(self.taus,50,100)
-        self.rTaus          = np.reciprocal(self.taus)
+        scale, _, _ = parameterRanges(self.inputsCount, self.hiddenCount)
+        mutationvector *= scale
+        self.vector += mutationvector
+        self._clip()
 
 
     def copy(self):
@@ -189,9 +438,48 @@ class Genome():
         Return:
             A genome object that is identical to the caller
         """
-        return Genome(inputsCount=self.inputsCount, hiddenCount=self.hiddenCount, outputsCount=self.outputsCount, iWeights=np.copy(self.inputWeights),
-                      weights=np.copy(self.weights), biases=np.copy(self.biases),
-                      taus=np.copy(self.taus))
+        return Genome.fromVector(self.vector.copy(), self.inputsCount, self.hiddenCount, self.outputsCount)
+
+    def toVector(self):
+        """
+        Return:
+            The vector backing the genome, in the same order as the beerMutate mutation vector
+        """
+        return self.vector
+
+    @staticmethod
+    def fromVector(vector, inputsCount=3, hiddenCount=3, outputsCount=1):
+        """
+        Create a genome backed by vector, without copying it
+
+        Parameters:
+            vector (np.array(float)) : The flattened parameters
+
+        Return:
+            A Genome object
+        """
+        genome = Genome.__new__(Genome)
+        genome._layout(inputsCount, hiddenCount, outputsCount, vector)
+        np.reciprocal(genome.taus, out=genome.rTaus)
+        return genome
+
+    def __getstate__(self):
+        return {"inputsCount" : self.inputsCount, "hiddenCount" : self.hiddenCount,
+                "outputsCount" : self.outputsCount, "vector" : np.asarray(self.vector)}
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled genome. Older pickles stored each parameter array
+        separately (along with unused outputWeights and gains), and are packed into a vector
+        """
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        if "vector" in state:
+            vector = np.asarray(state["vector"], dtype=np.float64)
+        else:
+            vector = np.concatenate([np.ravel(state[name]) for name in ("inputWeights", "weights", "biases", "taus")]).astype(np.float64)
+        self._layout(state["inputsCount"], state["hiddenCount"], state["outputsCount"], vector)
+        np.reciprocal(self.taus, out=self.rTaus)
     
     def __str__(self):
         """
@@ -202,6 +490,45 @@ class Genome():
         """
         return f"Input Weights: {self.inputWeights} \n" +\
                f"Weights: {self.weights} \nBiases: {self.biases} \nTaus: {self.taus}"
+
+
+def vectorLength(inputsCount, hiddenCount):
+    """
+    Return:
+        The number of parameters in a Genome with this layout
+    """
+    return inputsCount + hiddenCount*hiddenCount + 2*hiddenCount
+
+_ranges = {}
+
+def parameterRanges(inputsCount, hiddenCount):
+    """
+    The mutation scale and the clipping range of each element of a genome vector.
+    Weights and biases are scaled by 16 and kept in [-16, 16], taus are scaled by 25 and kept in [50, 100]
+
+    Return:
+        A tuple of three arrays, (scale, lower, upper)
+    """
+    key = (inputsCount, hiddenCount)
+    if key not in _ranges:
+        n = vectorLength(inputsCount, hiddenCount)
+        scale = np.full(n, 16.0)
+        lower = np.full(n, -16.0)
+        upper = np.full(n, 16.0)
+        scale[n-hiddenCount:] = 25
+        lower[n-hiddenCount:] = 50
+        upper[n-hiddenCount:] = 100
+        _ranges[key] = (scale, lower, upper)
+    return _ranges[key]
+
+def stackGenomes(genomes):
+    """
+    Stack the vectors of many genomes with the same layout into one matrix
+
+    Return:
+        A np.array(float) of shape (len(genomes), vectorLength)
+    """
+    return np.stack([genome.vector for genome in genomes])
         
 
 if __name__ == '__main__':
@@ -216,4 +543,4 @@ if __name__ == '__main__':
         time += 0.01
         print(nn.outputs)
 
-    
\ No newline at end of file
+    
@@ -0,0 +1,154 @@
+import itertools
+
+import numpy as np
+from scipy.special import expit
+
+# Fixed points of a CTRNN held at constant inputs. The states change as
+#     tau * ds/dt = F(s) = -s + sigmoid(s + biases) @ weights + inputs * inputWeights
+# so the fixed points are the roots of F, which are found with Newton's method from a
+# grid of starting states, for many input vectors at once.
+
+
+def parameters(genome):
+    """
+    Return:
+        The padded input weights, weights, biases and taus of genome as float arrays
+    """
+    iWeights = np.zeros(genome.hiddenCount)
+    iWeights[:genome.inputsCount] = genome.inputWeights
+    return iWeights, np.asarray(genome.weights,dtype=np.float64), np.asarray(genome.biases,dtype=np.float64), np.asarray(genome.taus,dtype=np.float64)
+
+
+def padInputs(genome, inputs):
+    """
+    Return:
+        inputs with zeros added for the hidden nodes without an input, shape = (..., hiddenCount)
+    """
+    inputs = np.asarray(inputs,dtype=np.float64)
+    padded = np.zeros(inputs.shape[:-1] + (genome.hiddenCount,))
+    padded[...,:genome.inputsCount] = inputs[...,:genome.inputsCount]
+    return padded
+
+
+def residual(genome, states, inputs):
+    """
+    F(states), which is 0 at a fixed point
+
+    Parameters:
+        genome (Genome) : The CTRNN
+        states (np.array(float)) : States of shape (..., hiddenCount)
+        inputs (np.array(float)) : Padded inputs, broadcast against states
+
+    Return:
+        An array the same shape as states
+    """
+    iWeights, weights, biases, _ = parameters(genome)
+    return -states + expit(states + biases) @ weights + inputs * iWeights
+
+
+def jacobian(genome, states):
+    """
+    The Jacobian of F, dF_j/ds_k = -delta_jk + weights[k,j] * sigmoid'(s_k + biases_k)
+
+    Return:
+        An array of shape (..., hiddenCount, hiddenCount)
+    """
+    _, weights, biases, _ = parameters(genome)
+    outputs = expit(states + biases)
+    slope = outputs * (1 - outputs)
+    return weights.T * slope[...,None,:] - np.eye(genome.hiddenCount)
+
+
+def classify(eigenvalues, tol=1e-9):
+    """
+    Name the stability of fixed points from the eigenvalues of their Jacobians
+
+    Parameters:
+        eigenvalues (np.array(complex)) : Shape (..., hiddenCount)
+
+    Return:
+        An array of "stable", "unstable" or "saddle", with " focus" added when
+        there are complex eigenvalues, so trajectories spiral
+    """
+    real = eigenvalues.real
+    stable = np.all(real < -tol, axis=-1)
+    unstable = np.all(real > tol, axis=-1)
+    focus = np.any(np.abs(eigenvalues.imag) > tol, axis=-1)
+    kind = np.where(stable, "stable", np.where(unstable, "unstable", "saddle")).astype(object)
+    kind[focus] += " focus"
+    return kind
+
+
+def seeds(hiddenCount, points=3, low=-10, high=10):
+    """
+    Return:
+        A grid of starting states with points values between low and high on each axis,
+        shape = (points**hiddenCount, hiddenCount)
+    """
+    return np.array(list(itertools.product(np.linspace(low,high,points),repeat=hiddenCount)))
+
+
+def solve(genome, inputs, starts=None, tol=1e-10, maxiter=100):
+    """
+    Find the fixed points of a CTRNN for each of many constant input vectors, running
+    a damped Newton iteration from every start for every input vector at once
+
+    Parameters:
+        genome (Genome) : The CTRNN
+        inputs (np.array(float)) : Input vectors, shape = (n, inputsCount)
+        starts (np.array(float)) : Starting states, shape = (m, hiddenCount), defaults to seeds(hiddenCount)
+        tol (float) : The largest residual accepted as a root
+        maxiter (int) : The number of Newton steps to take
+
+    Return:
+        A list with a tuple for each input vector of the distinct fixed points (k, hiddenCount),
+        the eigenvalues of the Jacobian of ds/dt at each (k, hiddenCount) and their stability (k,)
+    """
+    inputs = padInputs(genome, np.atleast_2d(inputs))
+    if starts is None:
+        starts = seeds(genome.hiddenCount)
+    n, m = len(inputs), len(starts)
+    # Every (input vector, start) pair is one row, and only the rows still searching are updated
+    states = np.tile(np.asarray(starts,dtype=np.float64), (n,1))
+    inputs = np.repeat(inputs, m, axis=0)
+    f = residual(genome, states, inputs)
+    norm = np.linalg.norm(f, axis=-1)
+    active = np.nonzero(norm >= tol)[0]
+    for _ in range(maxiter):
+        if len(active) == 0:
+            break
+        s, x, snorm = states[active], inputs[active], norm[active]
+        step = np.linalg.solve(jacobian(genome, s), -f[active][...,None])[...,0]
+        trial = s + step
+        tf = residual(genome, trial, x)
+        tnorm = np.linalg.norm(tf, axis=-1)
+        # Halve the step wherever it doesn't reduce the residual, as saturated sigmoids can overshoot
+        worse = np.nonzero(tnorm >= snorm)[0]
+        scale = 1
+        for _ in range(30):
+            if len(worse) == 0:
+                break
+            scale /= 2
+            trial[worse] = s[worse] + scale * step[worse]
+            tf[worse] = residual(genome, trial[worse], x[worse])
+            tnorm[worse] = np.linalg.norm(tf[worse], axis=-1)
+            worse = worse[tnorm[worse] >= snorm[worse]]
+        # Starts that can no longer make progress are given up on
+        moved = tnorm < snorm
+        states[active[moved]] = trial[moved]
+        f[active[moved]] = tf[moved]
+        norm[active[moved]] = tnorm[moved]
+        active = active[moved & (tnorm >= tol)]
+
+    states = states.reshape((n, m, -1))
+    converged = norm.reshape((n, m)) < tol
+    # A root is a duplicate if an earlier start of the same input vector converged to the same place
+    same = np.max(np.abs(states[:,:,None,:] - states[:,None,:,:]), axis=-1) < 1e-6
+    same &= converged[:,None,:] & np.tri(m, k=-1, dtype=bool)
+    distinct = converged & ~np.any(same, axis=-1)
+
+    # ds/dt = F(s)/tau, so the Jacobian of the dynamics has each row divided by tau
+    taus = parameters(genome)[3]
+    eigenvalues = np.linalg.eigvals(jacobian(genome, states) / taus[:,None])
+    kinds = classify(eigenvalues)
+    return [(states[i][distinct[i]], eigenvalues[i][distinct[i]], kinds[i][distinct[i]]) for i in range(n)]
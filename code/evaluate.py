@@ -1,79 +1,77 @@
-import json
-import pickle
 import random
 import sys
-from multiprocessing import Pool, Value, cpu_count
+from multiprocessing import Pool, cpu_count
 from statistics import mean, stdev
 
-import matplotlib.pyplot as plt
+import numpy as np
 
-import ctrnn
-import line_location
+import archive
+import configuration
+import rollout
 
-if len(sys.argv) < 4:
-    print("Usage: py ./evaluate.py config.json genome_name.pkl ntrials")
-    exit()
 
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
+def runtrials(c, tasks, settings):
+    """
+    Run a chunk of trials for one genome as a single batch
 
-simulation_seconds = settings.get("simulation_seconds",3)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+    Return:
+        Arrays of success (1 when fitness > 0.95), distance, touches and ctime for each trial
+    """
+    fitness, distance, touches, ctime = rollout.batch_rollout(c,tasks,settings)
+    return (fitness > 0.95).astype(int), distance, touches, ctime
 
 
-def runtrial(c, task):
-    sp, rp, goal = task
-    sim = line_location.line_location(senderPos=sp,receiverPos=rp,goal=goal)
-    time_const = line_location.line_location.timestep
+def evaluate(model, config, ntrials, pool=None):
+    """
+    Run a genome on ntrials random trials
 
-    sender = ctrnn.CTRNN(c,time_const)
-    receiver = ctrnn.CTRNN(c,time_const)
+    Parameters:
+        model (Genome) : The genome to be evaluated
+        config (dict or str) : The settings, or the path of a JSON file holding them
+        ntrials (int) : The number of trials
+        pool (multiprocessing.pool.Pool) : A pool set up with configuration.apply, None -> one is made here
 
-    sender.reset()
-    receiver.reset()
-    # Run the given simulation for up to num_steps time steps.
-    while sim.t < simulation_seconds:
-        senderstate = sim.getState(True)
-        receiverstate = sim.getState(False)
-        act1 = sender.eulerStep(senderstate)
-        act2 = receiver.eulerStep(receiverstate)
+    Return:
+        A dict of the number of successes, and the mean and standard deviation of the
+        distance from the goal, and the mean nudges and ctime
+    """
+    settings = configuration.load(config)
+    if pool is None:
+        configuration.apply(settings)
+        with Pool(processes=cpu_count(), initializer=configuration.apply, initargs=(settings,)) as pool:
+            return evaluate(model, settings, ntrials, pool)
 
-        senderOut = act1[0]
-        receiverOut = act2[0]
+    tasks = np.array([(random.uniform(0,0.3),random.uniform(0,0.3),random.uniform(0.5,1.0)) for _ in range(ntrials)])
+    # One large chunk of trials per worker, so the genome is only sent to each worker once
+    chunks = np.array_split(tasks, min(cpu_count(),ntrials))
+    results = pool.starmap(runtrials,[(model,chunk,settings) for chunk in chunks])
 
-        sim.step(senderOut,receiverOut)
-
-
-        # print(sim.getAsciiState())
-    distance = abs(sim.goal - sim.receiverPos)
-    if sim.fitness() > 0.95:
-        return (1,distance,sim.touches,sim.ctime)
-    else:
-        return (0,distance,sim.touches,sim.ctime)
+    successes = np.concatenate([result[0] for result in results]).tolist()
+    distances = np.concatenate([result[1] for result in results]).tolist()
+    nudges    = np.concatenate([result[2] for result in results]).tolist()
+    ctime     = np.concatenate([result[3] for result in results]).tolist()
+    return {"successes" : sum(successes), "ntrials" : ntrials, "distance" : mean(distances), "distance_std" : stdev(distances),
+            "nudges" : mean(nudges), "ctime" : mean(ctime)}
 
 
 def main():
-    with open(sys.argv[2], 'rb') as f:
-        c = pickle.load(f)
-
-
+    if len(sys.argv) < 4:
+        print("Usage: py ./evaluate.py config.json genome_name.pkl|archive.wgl[:name] ntrials")
+        exit()
+    settings = configuration.load(sys.argv[1])
+    configuration.apply(settings)
+    models = archive.loadModels(sys.argv[2])
     ntrials = int(sys.argv[3])
-    success = 0
-    absdist = 0
-    
-    with Pool(processes=cpu_count()) as pool:
-        tasks = [(c,(random.uniform(0,0.3),random.uniform(0,0.3),random.uniform(0.5,1.0))) for _ in range(ntrials)]
-        results = pool.starmap(runtrial,tasks)
-
-    successes = [result[0] for result in results]
-    distances = [result[1] for result in results]
-    nudges    = [result[2] for result in results]
-    ctime     = [result[3] for result in results]
 
-    print(f"{sum(successes)} ({100*sum(successes)/ntrials}%) successes across {ntrials} trials")
-    print(f"Mean absolute distance from goal: {mean(distances):.4f} (Standard deviation {stdev(distances):.4f})")
-    print(f"Mean Nudges: {mean(nudges)} ")
-    print(f"Mean ctime: {mean(ctime)}")
+    with Pool(processes=cpu_count(), initializer=configuration.apply, initargs=(settings,)) as pool:
+        for name, c in models:
+            result = evaluate(c, settings, ntrials, pool)
+            if len(models) > 1:
+                print(f"Model {name}")
+            print(f"{result['successes']} ({100*result['successes']/ntrials}%) successes across {ntrials} trials")
+            print(f"Mean absolute distance from goal: {result['distance']:.4f} (Standard deviation {result['distance_std']:.4f})")
+            print(f"Mean Nudges: {result['nudges']} ")
+            print(f"Mean ctime: {result['ctime']}")
 
 if __name__ == '__main__':
     main()
@@ -1,9 +1,24 @@
 import ctrnn
-import statistics
+import hashlib
+import json
+import queue
 import random
+import numpy as np
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from os import cpu_count
 
 mutationRate = 0.447
 centerCrossing = False
+# Stop evaluating a child once it can no longer reach its parent's fitness
+racing = False
+# An optional FitnessCache, consulted by assess and mutate before work is sent to the pool
+cache = None
+# An optional Surrogate, which pre-screens mutants in mutate and mutate_batch
+surrogate = None
+# An optional SuccessiveHalving, which scores mutants at low fidelity in mutate and mutate_batch
+halving = None
 class Citizen():
     def __init__(self,genome=None,fitness=0,age=0):
         if genome == None:
@@ -30,9 +45,16 @@ def assess(pop, pool, fitness,rs):
         The population, sorted by their newly assessed fitness scores 
     """
 
-    pop = [(x,fitness,rs) for x in pop]
-    pop = pool.starmap(assess_item, pop)
-    return sorted(pop, key = lambda i: i.fitness, reverse=True) 
+    if cache is not None:
+        fitnesses = cache.evaluate([x.genome for x in pop], rs, lambda genomes: pool.starmap(fitness, [(g,rs) for g in genomes]))
+        for item, f in zip(pop, fitnesses):
+            item.fitness = f
+    else:
+        pop = [(x,fitness,rs) for x in pop]
+        pop = pool.starmap(assess_item, pop)
+    if surrogate is not None:
+        surrogate.observe([x.genome for x in pop], [x.fitness for x in pop])
+    return sorted(pop, key = lambda i: i.fitness, reverse=True)
 
 def assess_item(item,fitness,rs):
     """
@@ -51,7 +73,8 @@ def assess_item(item,fitness,rs):
 
 def mutate(pop, pool,fitness,rs):
     """
-    Mutate each member of the population
+    Mutate each member of the population. The children are made in this process, so
+    mutation only draws from its random number generator, which is checkpointed
 
     Parameters:
         pop (list) : A list of members of the population
@@ -59,35 +82,777 @@ def mutate(pop, pool,fitness,rs):
         fitness (func) : A function with type Genome, Task -> Float
 
     Return:
-        pop, with a mutation applied to each member
+        pop, with a mutation applied to each member, the number of accepted
+        mutations and the number of trials skipped by racing
 
     """
-    pop = [(x,fitness,rs) for x in pop]
-    result = pool.starmap(mutate_item,pop)
-    pop = [x[0] for x in result]
-    
-    # pop = [x[0] for x in pop]
-    return sorted(pop, key = lambda i: i.fitness, reverse=True), sum(x[1] for x in result)
+    if surrogate is not None:
+        return mutate_screened(pop, lambda genomes: cached_evaluate(genomes, rs, lambda genomes: pool.starmap(fitness, [(g,rs) for g in genomes])))
+    if halving is not None:
+        return mutate_halving(pop, lambda genomes, fidelity: cached_evaluate(genomes, (rs, *fidelity) if fidelity else rs,
+                              lambda genomes: pool.starmap(fitness, [(g,rs,None,fidelity) for g in genomes])))
+
+    children = make_children(pop)
+    if racing:
+        result = pool.starmap(fitness, [(child,rs,x.fitness) for child, x in zip(children, pop)])
+        pop, count, _ = replace_parents(pop, children, [x[0] for x in result])
+        return pop, count, sum(x[1] for x in result)
+
+    cfitnesses = cached_evaluate(children, rs, lambda genomes: pool.starmap(fitness, [(g,rs) for g in genomes]))
+    return replace_parents(pop, children, cfitnesses)
 
 def mutate_item(item,fitness,rs):
     """
-    Mutate a single genome, only keep the result if it's better than the parent
+    Mutate a single genome, only keep the result if it's better than the parent.
+    When racing, fitness is also given the parent's fitness as a threshold and
+    returns the child's fitness along with the number of trials it skipped
 
     Parameters:
         item : A single member of the population
         fitness (func) : A function with type Genome, Task -> Float
     
     Return:
-        item, with a mutated genome (if it has better fitness than the original)
+        item, with a mutated genome (if it has better fitness than the original),
+        1 if the mutation was accepted, and the number of trials skipped
     """
 
     child = item.genome.copy()
     child.beerMutate(mutationRate)
-    cfitness = fitness(child,rs)
+    if racing:
+        cfitness, skipped = fitness(child,rs,item.fitness)
+    else:
+        cfitness, skipped = fitness(child,rs), 0
     if cfitness >= item.fitness:
-        return Citizen(child,cfitness), 1
+        return Citizen(child,cfitness), 1, skipped
     item.age += 1
-    return item, 0
+    return item, 0, skipped
+
+def make_children(pop):
+    """
+    Create a mutated copy of the genome of each member of the population
+
+    Return:
+        A list of genomes
+    """
+    children = []
+    for item in pop:
+        child = item.genome.copy()
+        child.beerMutate(mutationRate)
+        children.append(child)
+    return children
+
+def replace_parents(pop, children, cfitnesses):
+    """
+    Replace each member of the population with its child, if the child is at least as fit
+
+    Parameters:
+        pop (list) : A list of members of the population
+        children (list(Genome)) : The child of each member
+        cfitnesses (list(float)) : The fitness of each child
+
+    Return:
+        The new sorted population, the number of accepted mutations and the
+        number of trials skipped, which is 0 as children are always fully evaluated here
+    """
+    newpop = []
+    count = 0
+    for item, child, cfitness in zip(pop, children, cfitnesses):
+        if cfitness >= item.fitness:
+            newpop.append(Citizen(child,cfitness))
+            count += 1
+        else:
+            item.age += 1
+            newpop.append(item)
+    return sorted(newpop, key = lambda i: i.fitness, reverse=True), count, 0
+
+def race(trial_fitness, tasks, threshold, aggregate):
+    """
+    Evaluate trials one at a time, stopping as soon as the aggregate fitness can no
+    longer reach threshold even if every remaining trial scores the maximum of 1.
+    This relies on the aggregate being non-decreasing in each trial, as rank_reduce
+    and min_fitness are
+
+    Parameters:
+        trial_fitness (func) : A function with type Task -> Float
+        tasks (list) : The trials to be run
+        threshold (float) : The normalised fitness that has to be reached
+        aggregate (func) : A function with type List(Float) -> Float
+
+    Return:
+        The normalised fitness (an upper bound if stopped early), and the number of trials skipped
+    """
+    maxfitness = aggregate([1]*len(tasks))
+    fitnesses = []
+    for i, task in enumerate(tasks):
+        fitnesses.append(trial_fitness(task))
+        remaining = len(tasks) - i - 1
+        bound = aggregate(fitnesses + [1]*remaining)/maxfitness
+        if bound < threshold:
+            return bound, remaining
+    return aggregate(fitnesses)/maxfitness, 0
+
+def split(items, n=None):
+    """
+    Split a list into at most n contiguous chunks of near equal size
+
+    Parameters:
+        items (list) : The list to be split
+        n (int) : The number of chunks, defaults to the number of cpus
+
+    Return:
+        A list of lists
+    """
+    if n == None:
+        n = cpu_count()
+    n = max(1,min(n,len(items)))
+    size, extra = divmod(len(items),n)
+    chunks = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+def batch_evaluate(genomes, pool, batch_fitness, rs, fidelity=None):
+    """
+    Calculate the fitness of many genomes, giving each worker one large batch
+
+    Parameters:
+        genomes (list(Genome)) : The genomes to be evaluated
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        batch_fitness (func) : A function with type List(Genome), Seed -> List(Float)
+        fidelity (tuple) : If given, the (trials, seconds) passed on to batch_fitness
+
+    Return:
+        A list of fitnesses, in the same order as genomes
+    """
+    if fidelity is not None:
+        results = pool.starmap(batch_fitness, [(chunk,rs,fidelity) for chunk in split(genomes)])
+    else:
+        results = pool.starmap(batch_fitness, [(chunk,rs) for chunk in split(genomes)])
+    return [f for chunk in results for f in chunk]
+
+def assess_batch(pop, pool, batch_fitness, rs):
+    """
+    Calculate fitness score for each member across the given population, using
+    a batched fitness function so that a whole chunk of the population is simulated at once
+
+    Parameters:
+        pop (list) : A list of members of the population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        batch_fitness (func) : A function with type List(Genome), Seed -> List(Float)
+
+    Return:
+        The population, sorted by their newly assessed fitness scores
+    """
+    fitnesses = cached_evaluate([x.genome for x in pop], rs, lambda genomes: batch_evaluate(genomes, pool, batch_fitness, rs))
+    for item, f in zip(pop, fitnesses):
+        item.fitness = f
+    if surrogate is not None:
+        surrogate.observe([x.genome for x in pop], fitnesses)
+    return sorted(pop, key = lambda i: i.fitness, reverse=True)
+
+def mutate_batch(pop, pool, batch_fitness, rs):
+    """
+    Mutate each member of the population, evaluating all of the children in batches.
+    Children are only kept if they are at least as fit as their parent
+
+    Parameters:
+        pop (list) : A list of members of the population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        batch_fitness (func) : A function with type List(Genome), Seed -> List(Float)
+
+    Return:
+        pop, with a mutation applied to each member, the number of accepted mutations
+        and the number of trials skipped, which is always 0 as every trial is run at once
+    """
+    if surrogate is not None:
+        return mutate_screened(pop, lambda genomes: cached_evaluate(genomes, rs, lambda genomes: batch_evaluate(genomes, pool, batch_fitness, rs)))
+    if halving is not None:
+        return mutate_halving(pop, lambda genomes, fidelity: cached_evaluate(genomes, (rs, *fidelity) if fidelity else rs,
+                              lambda genomes: batch_evaluate(genomes, pool, batch_fitness, rs, fidelity)))
+    children = make_children(pop)
+    cfitnesses = cached_evaluate(children, rs, lambda genomes: batch_evaluate(genomes, pool, batch_fitness, rs))
+    return replace_parents(pop, children, cfitnesses)
+
+def evaluate_many(jobs, pool, fitness=None, batch_fitness=None):
+    """
+    Calculate the fitness of the genomes of several independent populations with a
+    single pool map, so the work of every population is interleaved across the workers
+    and no population waits for the others to finish their own map
+
+    Parameters:
+        jobs (list(tuple)) : A (genomes, rs) pair for each population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        fitness (func) : A function with type Genome, Seed -> Float
+        batch_fitness (func) : If given, used instead of fitness, with each population
+                               split into enough chunks to keep every worker busy
+
+    Return:
+        A list of fitnesses for each job, in the same order as its genomes
+    """
+    if batch_fitness is not None:
+        n = max(1, cpu_count() // len(jobs))
+        chunks = [(chunk,rs) for genomes, rs in jobs for chunk in split(genomes,n)]
+        results = [f for chunk in pool.starmap(batch_fitness, chunks) for f in chunk]
+    else:
+        results = pool.starmap(fitness, [(g,rs) for genomes, rs in jobs for g in genomes])
+
+    fitnesses = []
+    start = 0
+    for genomes, _ in jobs:
+        fitnesses.append(results[start:start+len(genomes)])
+        start += len(genomes)
+    return fitnesses
+
+class FitnessCache():
+    """
+    A bounded, least recently used cache of fitnesses. Entries are keyed by a hash of
+    the genome's parameters, the trials (or trial seed) and the configuration, so
+    duplicate genomes made by selection are only simulated once
+
+    Parameters:
+        maxsize (int) : The maximum number of fitnesses kept
+        config (dict) : The settings, which are part of every key
+    """
+    def __init__(self, maxsize=1024, config=None):
+        self.maxsize = maxsize
+        self.salt = json.dumps(config, sort_keys=True).encode()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, genome, trials):
+        h = hashlib.blake2b(self.salt, digest_size=16)
+        h.update(np.asarray(trials, dtype=np.float64).tobytes())
+        h.update(genome.toVector().tobytes())
+        return h.digest()
+
+    def evaluate(self, genomes, trials, evaluate):
+        """
+        Look up the fitness of each genome, evaluating each distinct missing genome once
+
+        Parameters:
+            genomes (list(Genome)) : The genomes to be evaluated
+            trials : The trial seed or the trials themselves
+            evaluate (func) : A function with type List(Genome) -> List(Float)
+
+        Return:
+            A list of fitnesses, in the same order as genomes
+        """
+        keys = [self.key(genome, trials) for genome in genomes]
+        found = {}
+        missing = {}
+        for key, genome in zip(keys, genomes):
+            if key in found or key in missing:
+                self.hits += 1
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                found[key] = self.entries[key]
+                self.hits += 1
+            else:
+                missing[key] = genome
+                self.misses += 1
+
+        if missing:
+            for key, f in zip(missing, evaluate(list(missing.values()))):
+                found[key] = f
+                self.entries[key] = f
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return [found[key] for key in keys]
+
+def cached_evaluate(genomes, trials, evaluate):
+    """
+    Evaluate genomes through the cache if there is one, otherwise directly
+
+    Return:
+        A list of fitnesses, in the same order as genomes
+    """
+    if cache is None:
+        return evaluate(genomes)
+    return cache.evaluate(genomes, trials, evaluate)
+
+def rank_correlation(a, b):
+    """
+    Return:
+        The Spearman rank correlation of two sequences, or nan if either is constant or has a nan
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    if len(a) < 2 or np.isnan(a).any() or np.isnan(b).any() or np.ptp(a) == 0 or np.ptp(b) == 0:
+        return np.nan
+    ra = np.argsort(np.argsort(a, kind="stable"), kind="stable")
+    rb = np.argsort(np.argsort(b, kind="stable"), kind="stable")
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+class Surrogate():
+    """
+    A cheap model of fitness, learnt from every genome simulated during the run, that
+    pre-screens mutants. Each parent gets several candidate children and keeps the one
+    predicted to be fittest, and only the children predicted to beat their parents' fitness
+    by the most are simulated. The model is ridge regression on the genome vector, scaled to
+    [0, 1] over ctrnn.parameterRanges, and random tanh features of it.
+
+    Screening only runs while the smoothed rank correlation between the predicted and the
+    simulated gain of children over their parents is at least threshold. Otherwise one child
+    is made for every parent and all of them are simulated, which keeps measuring the model
+    until it recovers
+
+    Parameters:
+        candidates (int) : The number of mutants made for each parent
+        simulate (float) : The fraction of parents whose child is simulated
+        features (int) : The number of random features
+        ridge (float) : The regularisation of the regression
+        window (int) : The number of most recent genome and fitness pairs learnt from
+        warmup (int) : The number of pairs needed before screening starts
+        threshold (float) : The smoothed rank correlation below which screening stops
+        smoothing (float) : The weight of the latest generation in the smoothed correlation
+        seed (int) : The seed of the random features
+    """
+    def __init__(self, candidates=4, simulate=0.5, features=128, ridge=1.0, window=4096, warmup=512,
+                 threshold=0.0, smoothing=0.3, seed=0):
+        self.candidates = candidates
+        self.simulate = simulate
+        self.features = features
+        self.ridge = ridge
+        self.window = window
+        self.warmup = warmup
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.rng = np.random.default_rng(seed)
+        # The features and fitness of the last window genomes, in a ring of which count have been filled
+        self.phi = None
+        self.targets = np.empty(window)
+        self.count = 0
+        self.coefficients = None
+        self.quality = None
+        # The last generation, and totals over the run
+        self.correlation = np.nan
+        self.gainCorrelation = np.nan
+        self.simulated = 0
+        self.saved = 0
+        self.screened = False
+        self.totalSimulated = 0
+        self.totalSaved = 0
+
+    def _features(self, genomes):
+        if self.phi is None:
+            genome = genomes[0]
+            _, self.lower, self.upper = ctrnn.parameterRanges(genome.inputsCount, genome.hiddenCount)
+            n = len(genome.vector)
+            self.projection = self.rng.normal(0, 2 / np.sqrt(n), (n, self.features))
+            self.offset = self.rng.uniform(-1, 1, self.features)
+            self.phi = np.empty((self.window, n + self.features))
+        x = (np.array([g.vector for g in genomes]) - self.lower) / (self.upper - self.lower)
+        return np.hstack([x, np.tanh((2*x - 1) @ self.projection + self.offset)])
+
+    def observe(self, genomes, fitnesses):
+        """
+        Add simulated genomes to what the model learns from. It is refitted when it is next used
+        """
+        phi = self._features(genomes)[-self.window:]
+        rows = np.arange(self.count, self.count + len(phi)) % self.window
+        self.phi[rows] = phi
+        self.targets[rows] = np.asarray(fitnesses)[-self.window:]
+        self.count += len(phi)
+        self.coefficients = None
+
+    def fit(self):
+        n = min(self.count, self.window)
+        phi, y = self.phi[:n], self.targets[:n]
+        self.means = phi.mean(0), y.mean()
+        phi = phi - self.means[0]
+        a = phi.T @ phi + self.ridge * np.eye(phi.shape[1])
+        self.coefficients = np.linalg.solve(a, phi.T @ (y - self.means[1]))
+
+    def predict(self, genomes):
+        """
+        Return:
+            The predicted fitness of each genome
+        """
+        if self.coefficients is None:
+            self.fit()
+        return (self._features(genomes) - self.means[0]) @ self.coefficients + self.means[1]
+
+    def active(self):
+        """
+        Return:
+            Whether mutants are screened, which needs warmup pairs and a good enough correlation
+        """
+        return self.count >= self.warmup and (self.quality is None or self.quality >= self.threshold)
+
+    def record(self, predicted, fitnesses, predictedGains, gains, saved):
+        """
+        Track the accuracy of the model on the simulated children of a generation, and the
+        simulations saved. Screening is decided by how well the gain of each child over its
+        parent is ranked, as the fitness of children is mostly that of their parents
+
+        Parameters:
+            predicted, fitnesses (np.array) : The predicted and simulated fitness of each child
+            predictedGains, gains (np.array) : The same, less the fitness of the parent
+            saved (int) : The number of parents whose child was not simulated
+        """
+        self.correlation = rank_correlation(predicted, fitnesses)
+        self.gainCorrelation = rank_correlation(predictedGains, gains)
+        if not np.isnan(self.gainCorrelation):
+            self.quality = self.gainCorrelation if self.quality is None else \
+                           (1 - self.smoothing) * self.quality + self.smoothing * self.gainCorrelation
+        self.simulated = len(fitnesses)
+        self.saved = saved
+        self.totalSimulated += self.simulated
+        self.totalSaved += saved
+
+def mutate_screened(pop, evaluate):
+    """
+    Mutate each member of the population, pre-screening the children with the surrogate.
+    Parents whose child is not simulated are kept, as if the mutation had been rejected
+
+    Parameters:
+        pop (list) : A list of members of the population
+        evaluate (func) : A function with type List(Genome) -> List(Float), on the trials of this generation
+
+    Return:
+        The new sorted population, the number of accepted mutations and the number of
+        trials skipped, which is 0 as children are always fully evaluated here
+    """
+    surrogate.screened = surrogate.active()
+    parents = np.array([x.fitness for x in pop])
+    chosen = np.arange(len(pop))
+    if surrogate.screened:
+        candidates = [make_children(pop) for _ in range(surrogate.candidates)]
+        scores = surrogate.predict([c for children in candidates for c in children]).reshape(len(candidates), len(pop))
+        best = scores.argmax(0)
+        children = [candidates[k][i] for i, k in enumerate(best)]
+        predicted = scores[best, chosen]
+        count = max(1, round(surrogate.simulate * len(pop)))
+        chosen = np.sort(np.argsort(parents - predicted, kind="stable")[:count])
+    else:
+        children = make_children(pop)
+        predicted = surrogate.predict(children) if surrogate.count else np.full(len(pop), np.nan)
+
+    simulated = evaluate([children[i] for i in chosen])
+    surrogate.observe([children[i] for i in chosen], simulated)
+    surrogate.record(predicted[chosen], simulated, (predicted - parents)[chosen],
+                     [f - pop[i].fitness for i, f in zip(chosen, simulated)], len(pop) - len(chosen))
+    cfitnesses = [-np.inf] * len(pop)
+    for i, f in zip(chosen, simulated):
+        cfitnesses[i] = f
+    return replace_parents(pop, children, cfitnesses)
+
+class SuccessiveHalving():
+    """
+    Multi-fidelity evaluation by successive halving. Genomes are scored in rounds of rising
+    fidelity, each with fewer trials or shorter simulations than a full evaluation, and
+    only the best of each round go on to the next. The survivors of the last round are
+    evaluated at full fidelity. The numbers kept shrink geometrically from the number of
+    genomes to the number of survivors
+
+    Parameters:
+        rungs (list(tuple)) : The (trials, seconds) of each round, from the lowest fidelity up
+        promote (float) : The fraction of mutants promoted to full fidelity
+        full (tuple) : The (trials, seconds) of a full evaluation
+    """
+    def __init__(self, rungs=(), promote=0.5, full=(20, 3)):
+        self.rungs = [tuple(rung) for rung in rungs]
+        self.promote = promote
+        self.full = tuple(full)
+        # The last call of halve, and totals over the run
+        self.evaluations = []
+        self.promoted = 0
+        self.cost = 0
+        self.saved = 0
+        self.totalCost = 0
+        self.totalSaved = 0
+
+    def price(self, fidelity):
+        """
+        Return:
+            The cost of an evaluation at fidelity, as a fraction of a full evaluation
+        """
+        return fidelity[0] * fidelity[1] / (self.full[0] * self.full[1])
+
+    def halve(self, genomes, evaluate, survivors):
+        """
+        Parameters:
+            genomes (list(Genome)) : The genomes to be screened
+            evaluate (func) : A function with type List(Genome), Fidelity -> List(Float),
+                              where the fidelity is one of rungs, or None for a full evaluation
+            survivors (int) : The number of genomes evaluated at full fidelity and returned
+
+        Return:
+            The indices of the survivors in genomes, in order, and their full fitness
+        """
+        chosen = np.arange(len(genomes))
+        self.evaluations = []
+        self.cost = 0
+        for i, rung in enumerate(self.rungs):
+            scores = evaluate([genomes[j] for j in chosen], rung)
+            self.evaluations.append(len(chosen))
+            self.cost += len(chosen) * self.price(rung)
+            keep = max(survivors, round(len(genomes) * (survivors / len(genomes))**((i + 1) / len(self.rungs))))
+            chosen = np.sort(chosen[np.argsort(-np.asarray(scores), kind="stable")[:keep]])
+
+        fitnesses = np.asarray(evaluate([genomes[j] for j in chosen], None))
+        self.evaluations.append(len(chosen))
+        self.cost += len(chosen)
+        # Without any rounds every genome is evaluated in full, and only the best are kept
+        best = np.sort(np.argsort(-fitnesses, kind="stable")[:survivors])
+        self.promoted = len(best)
+        self.saved = len(genomes) - self.cost
+        self.totalCost += self.cost
+        self.totalSaved += self.saved
+        return chosen[best], list(fitnesses[best])
+
+def mutate_halving(pop, evaluate):
+    """
+    Mutate each member of the population, evaluating the children by successive halving.
+    Parents whose child is not promoted to full fidelity are kept, as if the mutation had
+    been rejected
+
+    Parameters:
+        pop (list) : A list of members of the population
+        evaluate (func) : A function with type List(Genome), Fidelity -> List(Float), on the trials of this generation
+
+    Return:
+        The new sorted population, the number of accepted mutations and the number of
+        trials skipped, which is 0 as promoted children are always fully evaluated
+    """
+    children = make_children(pop)
+    chosen, fitnesses = halving.halve(children, evaluate, max(1, round(halving.promote * len(pop))))
+    cfitnesses = [-np.inf] * len(pop)
+    for i, f in zip(chosen, fitnesses):
+        cfitnesses[i] = f
+    return replace_parents(pop, children, cfitnesses)
+
+class SharedArray():
+    """
+    A numpy array held in shared memory. When pickled only the name and shape are
+    sent, and the receiving process attaches to the same memory rather than copying it.
+    Create these before starting the pool, so the workers share the parent's resource tracker
+
+    Parameters:
+        shape (tuple(int)) : The shape of the array
+        name (str) : The name of an existing block to attach to, None -> create a new block
+    """
+    # Blocks this process has already attached to, so each worker only attaches once
+    attached = {}
+
+    def __init__(self, shape, name=None):
+        self.shape = tuple(shape)
+        if name == None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(1,8*int(np.prod(self.shape))))
+        elif name in SharedArray.attached:
+            self.shm = SharedArray.attached[name]
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            SharedArray.attached[name] = self.shm
+        self.name = self.shm.name
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return (self.shape, self.name)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def unlink(self):
+        """
+        Free the shared memory, this should only be called by the process that created it
+        """
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+class SharedPopulation():
+    """
+    The genomes of a population and the trials of the current generation, held in
+    shared memory so that workers only need to be sent indices. Rows [0, size) hold
+    the population and rows [size, 2*size) hold their children
+
+    Parameters:
+        size (int) : The population size
+        ntrials (int) : The number of trials in each generation
+        inputsCount, hiddenCount, outputsCount (int) : The layout of every genome
+    """
+    def __init__(self, size, ntrials, inputsCount=3, hiddenCount=3, outputsCount=1):
+        self.size = size
+        self.layout = (inputsCount, hiddenCount, outputsCount)
+        self.genomes = SharedArray((2*size, inputsCount + hiddenCount*hiddenCount + 2*hiddenCount))
+        self.tasks = SharedArray((ntrials, 3))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.genomes.unlink()
+        self.tasks.unlink()
+
+    def genome(self, row):
+        """
+        Return:
+            A Genome whose parameters are views of the given row
+        """
+        return ctrnn.Genome.fromVector(self.genomes.array[row], *self.layout)
+
+    def publish(self, genomes, tasks, offset=0):
+        """
+        Write genomes into the rows starting at offset, and the trials for this generation
+
+        Parameters:
+            genomes (list(Genome)) : The genomes to be written
+            tasks (list(tuple(float))) : The sender start, receiver start and goal of each trial
+        """
+        for i, genome in enumerate(genomes):
+            self.genomes.array[offset+i] = genome.toVector()
+        self.tasks.array[:] = tasks
+
+def assess_shared(pop, pool, shared, trial_fitness, tasks):
+    """
+    Calculate fitness score for each member across the given population, with the
+    genomes and trials published to shared memory so only indices and fitnesses are sent
+
+    Parameters:
+        pop (list) : A list of members of the population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        shared (SharedPopulation) : The shared memory for this population
+        trial_fitness (func) : A function with type Genome, List(Task) -> Float
+        tasks (list) : The trials for this generation
+
+    Return:
+        The population, sorted by their newly assessed fitness scores
+    """
+    def evaluate(genomes):
+        shared.publish(genomes, tasks)
+        return pool.starmap(assess_shared_item, [(i,shared,trial_fitness) for i in range(len(genomes))])
+
+    fitnesses = cached_evaluate([x.genome for x in pop], tasks, evaluate)
+    for item, f in zip(pop, fitnesses):
+        item.fitness = f
+    return sorted(pop, key = lambda i: i.fitness, reverse=True)
+
+def assess_shared_item(row, shared, trial_fitness):
+    """
+    Calculate the fitness of the genome in a row of shared memory
+
+    Return:
+        The fitness (float)
+    """
+    return trial_fitness(shared.genome(row), shared.tasks.array)
+
+def mutate_shared(pop, pool, shared, trial_fitness, tasks):
+    """
+    Mutate each member of the population, with the children published to shared
+    memory. Workers only return the child's fitness, whether it was accepted and the
+    number of trials skipped by racing
+
+    Parameters:
+        pop (list) : A list of members of the population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        shared (SharedPopulation) : The shared memory for this population
+        trial_fitness (func) : A function with type Genome, List(Task) -> Float
+        tasks (list) : The trials for this generation
+
+    Return:
+        pop, with a mutation applied to each member, the number of accepted
+        mutations and the number of trials skipped by racing
+    """
+    children = make_children(pop)
+    if cache is not None and not racing:
+        def evaluate(genomes):
+            shared.publish(genomes, tasks, shared.size)
+            return pool.starmap(assess_shared_item, [(shared.size+i,shared,trial_fitness) for i in range(len(genomes))])
+        return replace_parents(pop, children, cache.evaluate(children, tasks, evaluate))
+
+    shared.publish(children, tasks, shared.size)
+
+    args = [(shared.size+i,item.fitness,shared,trial_fitness) for i, item in enumerate(pop)]
+    result = pool.starmap(mutate_shared_item, args)
+    newpop = []
+    for item, child, (cfitness, accepted, skipped) in zip(pop, children, result):
+        if accepted:
+            newpop.append(Citizen(child,cfitness))
+        else:
+            item.age += 1
+            newpop.append(item)
+    return sorted(newpop, key = lambda i: i.fitness, reverse=True), sum(x[1] for x in result), sum(x[2] for x in result)
+
+def mutate_shared_item(row, pfitness, shared, trial_fitness):
+    """
+    Evaluate the child in a row of shared memory against its parent's fitness
+
+    Return:
+        The child's fitness, 1 if it should replace the parent, and the number of trials skipped
+    """
+    if racing:
+        cfitness, skipped = trial_fitness(shared.genome(row), shared.tasks.array, pfitness)
+    else:
+        cfitness, skipped = trial_fitness(shared.genome(row), shared.tasks.array), 0
+    return cfitness, int(cfitness >= pfitness), skipped
+
+def steady_state(pop, pool, fitness, inflight=None):
+    """
+    Asynchronous steady state evolution. A fixed number of tasks are kept in flight,
+    each one re-assessing a parent chosen by rank roulette selection and evaluating a
+    mutated child on the same fresh trials. As each task finishes, the parent's fitness
+    is updated, a child at least as fit as its parent replaces the worst member of the
+    population, and a new task is started, so no worker waits on the rest of a
+    generation. This generator runs until it is closed
+
+    Parameters:
+        pop (list) : A sorted, assessed population
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        fitness (func) : A function with type Genome, Seed -> Float
+        inflight (int) : The number of tasks in flight, defaults to twice the number of cpus
+
+    Yield:
+        The sorted population, 1 if the child was accepted, and the number of trials
+        skipped by racing, after each finished task
+    """
+    if inflight == None:
+        inflight = 2 * cpu_count()
+    results = queue.Queue()
+
+    def submit():
+        parent = rank_roulette_select(pop,1)[0]
+        child = parent.genome.copy()
+        child.beerMutate(mutationRate)
+        pool.apply_async(steady_state_item, (parent.genome,child,fitness,random.random()),
+                         callback=lambda r: results.put((parent,child,r)), error_callback=results.put)
+
+    for _ in range(inflight):
+        submit()
+    while True:
+        result = results.get()
+        if isinstance(result, BaseException):
+            raise result
+        parent, child, (pfitness, cfitness, skipped) = result
+
+        # The parent is updated in place, as it may still be in the population
+        parent.fitness = pfitness
+        pop.sort(key = lambda i: i.fitness, reverse=True)
+        if cfitness >= pfitness:
+            pop[-1] = Citizen(child,cfitness)
+            pop.sort(key = lambda i: i.fitness, reverse=True)
+        else:
+            parent.age += 1
+
+        submit()
+        yield pop, int(cfitness >= pfitness), skipped
+
+def steady_state_item(parent, child, fitness, rs):
+    """
+    Evaluate a parent and its child on the same trials
+
+    Return:
+        The parent's fitness, the child's fitness and the number of trials skipped by racing
+    """
+    pfitness = fitness(parent,rs)
+    if racing:
+        cfitness, skipped = fitness(child,rs,pfitness)
+    else:
+        cfitness, skipped = fitness(child,rs), 0
+    return pfitness, cfitness, skipped
 
 def rank_reduce(fitnesses):
     """
@@ -103,6 +868,19 @@ def rank_reduce(fitnesses):
     s_fitnesses = sorted(fitnesses)
     return sum([elem/(i+1) for i,elem in enumerate(s_fitnesses)])
 
+def rank_reduce_batch(fitnesses):
+    """
+    rank_reduce applied along the last axis of an array of fitnesses
+
+    Parameters:
+        fitnesses (np.array(float))
+
+    Return:
+        An array with the last axis reduced
+    """
+    s_fitnesses = np.sort(fitnesses,axis=-1)
+    return (s_fitnesses / np.arange(1,s_fitnesses.shape[-1]+1)).sum(-1)
+
 def min_fitness(fitnesses):
     return min(fitnesses)
 
@@ -111,10 +889,7 @@ def initialise(pop_size):
     Initialise a population of random genomes
 
     Parameters:
-        pop_size (int) : The number of members of the seed population
         pop_size (int) : The number of members population members to be returned
-        pool (multiprocessing.pool.Pool) : A multiprocessing pool
-        fitness (func) : A function with type Genome, Task -> Float
         
     Return:
         A list containing pop_size members
@@ -126,6 +901,25 @@ def initialise(pop_size):
 
     return pop
 
+def initialise_screened(initial_size, pop_size, evaluate):
+    """
+    Initialise a population from the best of a larger number of random genomes, screened
+    by successive halving with the rounds of halving, or only at full fidelity without it
+
+    Parameters:
+        initial_size (int) : The number of random genomes screened
+        pop_size (int) : The number of members to be returned
+        evaluate (func) : A function with type List(Genome), Fidelity -> List(Float), see SuccessiveHalving.halve
+
+    Return:
+        A list containing pop_size members, with their full fitness, and the SuccessiveHalving
+        used, which holds the cost of screening
+    """
+    screen = SuccessiveHalving(halving.rungs, full=halving.full) if halving is not None else SuccessiveHalving()
+    genomes = [x.genome for x in initialise(initial_size)]
+    chosen, fitnesses = screen.halve(genomes, evaluate, pop_size)
+    return [Citizen(genomes[i], f) for i, f in zip(chosen, fitnesses)], screen
+
 def selection(pop,elitism=0,size=None):
     elites = pop[:elitism]
     sel = rank_roulette_select(pop[elitism:],size)
@@ -192,7 +986,111 @@ def truncation_select(pop):
 
 
 
-def log_fitness(pop, gen, mcount, file=None):
+class Optimizer(ABC):
+    """
+    The interface of optimizers that propose whole generations of genomes. ask gives the
+    genomes to evaluate, tell is given their fitness and keeps them as genomes and fitnesses,
+    and population is what gets logged. A subclass missing ask or tell can't be built.
+    The sus and beerMutate hill climber is the default, run by train.train itself
+    """
+    @abstractmethod
+    def ask(self):
+        """
+        Return:
+            A list of genomes to be evaluated
+        """
+
+    @abstractmethod
+    def tell(self, genomes, fitnesses):
+        """
+        Update the optimizer with the fitness of each genome given by the last ask
+        """
+
+    def population(self):
+        """
+        Return:
+            The last generation told as Citizens, sorted by fitness
+        """
+        return sorted([Citizen(g,f) for g, f in zip(self.genomes, self.fitnesses)], key = lambda i: i.fitness, reverse=True)
+
+class SepCMAES(Optimizer):
+    """
+    Separable CMA-ES (Ros and Hansen 2008), an evolution strategy with a diagonal covariance,
+    on the flat genome vector. The search runs with every parameter scaled to [0, 1] over
+    the clipping range of ctrnn.parameterRanges, and samples are clipped back into range
+    before they are evaluated and used to update the distribution
+
+    Parameters:
+        size (int) : The number of genomes in each generation (lambda)
+        sigma (float) : The initial step size, as a fraction of each parameter's range
+        mean (Genome) : The genome to start from, None -> a random genome
+    """
+    def __init__(self, size, sigma=0.3, mean=None):
+        if mean is None:
+            mean = ctrnn.Genome(centerCrossing=centerCrossing)
+        self.layout = (mean.inputsCount, mean.hiddenCount, mean.outputsCount)
+        _, self.lower, self.upper = ctrnn.parameterRanges(mean.inputsCount, mean.hiddenCount)
+        self.width = self.upper - self.lower
+        n = len(mean.vector)
+        self.n = n
+        self.size = size
+        self.mean = (mean.vector - self.lower) / self.width
+        self.sigma = sigma
+        self.diagonal = np.ones(n)
+        self.ps = np.zeros(n)
+        self.pc = np.zeros(n)
+        self.generation = 0
+        self.genomes = []
+        self.fitnesses = []
+
+        self.mu = size // 2
+        weights = np.log((size + 1) / 2) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / (self.weights**2).sum()
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        # The learning rates of the full method, raised by (n+2)/3 as only the diagonal is learnt
+        self.c1 = 2 / ((n + 1.3)**2 + self.mueff) * (n + 2) / 3
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2)**2 + self.mueff) * (n + 2) / 3)
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chiN = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n**2))
+
+    def ask(self):
+        z = np.random.normal(0, 1, (self.size, self.n))
+        samples = np.clip(self.mean + self.sigma * np.sqrt(self.diagonal) * z, 0, 1)
+        self.samples = samples
+        self.genomes = [ctrnn.Genome.fromVector(self.lower + self.width * u, *self.layout) for u in samples]
+        return self.genomes
+
+    def tell(self, genomes, fitnesses):
+        self.fitnesses = list(fitnesses)
+        order = np.argsort(-np.asarray(fitnesses), kind="stable")[:self.mu]
+        # The steps actually taken, after clipping
+        y = (self.samples[order] - self.mean) / self.sigma
+        yw = self.weights @ y
+        self.mean = self.mean + self.sigma * yw
+
+        self.generation += 1
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * yw / np.sqrt(self.diagonal)
+        norm = np.linalg.norm(self.ps)
+        hsig = norm / np.sqrt(1 - (1 - self.cs)**(2 * self.generation)) / self.chiN < 1.4 + 2 / (self.n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * yw
+        self.diagonal = (1 - self.c1 - self.cmu) * self.diagonal \
+                        + self.c1 * (self.pc**2 + (1 - hsig) * self.cc * (2 - self.cc) * self.diagonal) \
+                        + self.cmu * (self.weights @ y**2)
+        self.sigma *= np.exp(self.cs / self.damps * (norm / self.chiN - 1))
+
+    def best(self):
+        """
+        Return:
+            The genome at the mean of the distribution
+        """
+        return ctrnn.Genome.fromVector(self.lower + self.width * np.clip(self.mean, 0, 1), *self.layout)
+
+# The optimizers that can be chosen with "optimizer" in the config, besides "hillclimber"
+optimizers = {"cmaes" : SepCMAES}
+
+def log_fitness(pop, gen, mcount, file=None, skipped=None, metrics=None):
     """
     Write aggregate statistics of the population, either to a file or to stdout
 
@@ -200,13 +1098,25 @@ def log_fitness(pop, gen, mcount, file=None):
         pop (list) : The population
         gen (int) : The generation number
         file (file) : The file that will be written to, None -> Stdout
+        skipped (int) : The number of trials skipped by racing, only logged if given
+        metrics (metrics.MetricsLog) : If given, the metrics of the generation are also recorded here
     """
     
-    fitness = [x.fitness for x in pop]
-    ages = [x.age for x in pop]
-    fline = "{:4d} - Fitness  : max:{:.3f}, min:{:.3f}, mean:{:.3f}".format(gen,max(fitness),min(fitness),statistics.mean(fitness))
-    aline = "{:4d} - Age      : max:{:.3f}, min:{:.3f}, median:{:.3f}".format(gen,max(ages),min(ages),statistics.median(ages))
+    fitness = np.array([x.fitness for x in pop])
+    ages = np.array([x.age for x in pop])
+    fline = "{:4d} - Fitness  : max:{:.3f}, min:{:.3f}, mean:{:.3f}".format(gen,fitness.max(),fitness.min(),fitness.mean())
+    aline = "{:4d} - Age      : max:{:.3f}, min:{:.3f}, median:{:.3f}".format(gen,ages.max(),ages.min(),np.median(ages))
     mline = f"{gen:4d} - Mutations: {mcount}"
+    if skipped is not None:
+        mline += f"\n{gen:4d} - Skipped  : {skipped}"
+    if cache is not None:
+        mline += f"\n{gen:4d} - Cache    : hits:{cache.hits}, misses:{cache.misses}"
+    if surrogate is not None:
+        mline += f"\n{gen:4d} - Surrogate: correlation:{surrogate.correlation:.3f}, gain correlation:{surrogate.gainCorrelation:.3f}, screened:{surrogate.screened}, simulated:{surrogate.simulated}, saved:{surrogate.saved}"
+    if halving is not None:
+        mline += f"\n{gen:4d} - Halving  : evaluations:{halving.evaluations}, promoted:{halving.promoted}, cost:{halving.cost:.2f}, saved:{halving.saved:.2f}"
+    if metrics is not None:
+        metrics.record(gen, fitness, ages, mcount, skipped, cache, surrogate, halving)
 
     if file:
         file.write(fline+"\n"+aline+"\n"+mline+"\n")
@@ -1,28 +1,27 @@
-import json
-import pickle
 import random
 import itertools
 import sys
 
 import matplotlib.pyplot as plt
 
+import archive
+import configuration
 import ctrnn
+import equilibria
 import line_location
 import numpy as np
 
 if len(sys.argv) < 3:
-    print("Usage: py ./test.py config.json genome_name.pkl")
+    print("Usage: py ./fixedpoint.py config.json genome_name.pkl")
     exit()
 
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
+settings = configuration.load(sys.argv[1])
 
 simulation_seconds = settings.get("simulation_seconds",3)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+configuration.apply(settings)
 
 # load the winner
-with open(sys.argv[2], 'rb') as f:
-    c = pickle.load(f)
+c = archive.loadModel(sys.argv[2])
 
 print('Loaded genome:')
 print(c)
@@ -36,39 +35,29 @@ positions = (0,0)
 # This is decoupled, what would coupled look like?
 # inplist = [[0,-0.34,-0.6]]
 inplist = [[np.random.uniform(-1,1),np.random.uniform(-1,1),np.random.uniform(-1,1)] for _ in range(10)]
-for inputs in inplist:
+time_const = line_location.line_location.timestep
+corners = np.array(list(itertools.product([-10,10],repeat=3)),dtype=np.float64)
+
+# Every input vector and corner state is integrated together, shape = (records, 1, inputs, corners, hiddenCount)
+brain = ctrnn.BatchCTRNN([c],(len(inplist),len(corners)),time_const,settings.get("integrator","euler"))
+brain.setStates(corners)
+trajectories = brain.trajectory(np.array(inplist)[None,:,None,:],int(np.ceil(10000/time_const)))
+fixedpoints = equilibria.solve(c,inplist)
+
+for i, inputs in enumerate(inplist):
     print(inputs)
     fig = plt.figure()
     ax = plt.axes(projection="3d")
-    for state in itertools.product([-10,10],repeat=3):
-        # state = [np.random.uniform(-10,10),np.random.uniform(-10,10),np.random.uniform(-10,10)]
-        
-        states = state
-        t = 0
-            
-        time_const = line_location.line_location.timestep
-
-        brain = ctrnn.CTRNN(c,time_const)
-        brain.setStates(np.array(state,dtype=np.float64))
-        # Run the given simulation for up to num_steps time steps.
-        while t < 10000:
-            # if sim.t < 1.5:
-            #     receiverstate[0] = 0
-            #     senderstate[0] = 0
-
-            brain.eulerStep(inputs)
-
-            states = np.vstack([states,brain.states])
-            t += time_const
-        
+    for j in range(len(corners)):
+        states = trajectories[:,0,i,j]
         ax.plot3D(states[:,0],states[:,1],states[:,2])
         print(states[-1])
         ax.scatter3D(states[::10,0],states[::10,1],states[::10,2])
         ax.set_xlabel("Neuron 1")
         ax.set_ylabel("Neuron 2")
         ax.set_zlabel("Neuron 3")
-
-
-            # print(sim.getAsciiState())
+    for point, eigenvalues, kind in zip(*fixedpoints[i]):
+        print(f"Fixed point {point} is {kind}, eigenvalues {eigenvalues}")
+        ax.scatter3D(*point,color="black",marker="o" if kind.startswith("stable") else "x",s=60)
 
     plt.show()
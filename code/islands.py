@@ -0,0 +1,235 @@
+import os
+import pickle
+import queue
+import random
+import sys
+import time
+from multiprocessing import Process, Queue, cpu_count
+
+import numpy as np
+
+import evolve
+import metrics
+import replicates
+import train
+
+# The island model. Several populations evolve in their own processes, each running the
+# usual sus and mutate loop, and every migration_interval generations each island sends
+# copies of its best members to its neighbours, which replace their worst members.
+# Islands only talk through objects with put and get, so the multiprocessing queues used
+# here can be swapped for socket backed queues, e.g. from a multiprocessing.managers.BaseManager,
+# to spread the islands over several nodes.
+# Usage: py ./islands.py config.json [islands]
+
+islands = cpu_count()
+island_size = train.population_size
+migration_interval = 10
+migrants = 2
+topology = "ring"
+
+
+def configure(config):
+    """
+    Set up training and the island model in this process
+
+    Parameters:
+        config (dict or str) : The settings, or the path of a JSON file holding them
+    """
+    global islands, island_size, migration_interval, migrants, topology
+    train.configure(config)
+    islands = train.settings.get("islands", cpu_count())
+    island_size = train.settings.get("island_size", train.population_size)
+    migration_interval = train.settings.get("migration_interval", 10)
+    migrants = train.settings.get("migrants", 2)
+    topology = train.settings.get("topology", "ring")
+    check(island_size, migrants)
+
+
+def check(size, count):
+    """
+    Raise a ValueError unless islands of size genomes can be selected from and send count migrants
+
+    Parameters:
+        size (int) : The population size of each island
+        count (int) : The number of migrants each island sends
+    """
+    if size < 2:
+        raise ValueError(f"Islands need at least 2 genomes each for selection, got an island_size of {size}")
+    if count >= size:
+        raise ValueError(f"Islands must send fewer migrants than they hold, got {count} migrants for an island_size of {size}")
+
+
+def neighbours(name, n):
+    """
+    The islands each island sends its migrants to
+
+    Parameters:
+        name (str) : "ring" or "full"
+        n (int) : The number of islands
+
+    Return:
+        A list of destinations for each island
+    """
+    if n == 1:
+        return [[]]
+    if name == "ring":
+        return [[(i+1) % n] for i in range(n)]
+    if name == "full":
+        return [[j for j in range(n) if j != i] for i in range(n)]
+    raise ValueError(f"Unknown topology {name}")
+
+
+def migrate(pop, outboxes, inbox, incoming, count):
+    """
+    Send copies of the best members of pop to every outbox, then wait for the migrants
+    sent to this island, which replace its worst members
+
+    Parameters:
+        pop (list) : The sorted population
+        outboxes (list) : Queues of the islands to send to
+        inbox : The queue of this island
+        incoming (int) : The number of islands that send to this island
+        count (int) : The number of migrants to send
+
+    Return:
+        The new sorted population
+    """
+    emigrants = [evolve.Citizen(x.genome.copy(), x.fitness, x.age) for x in pop[:count]]
+    for outbox in outboxes:
+        outbox.put(emigrants)
+    immigrants = [x for _ in range(incoming) for x in inbox.get()]
+    immigrants = sorted(immigrants, key = lambda i: i.fitness, reverse=True)[:len(pop)-count]
+    if immigrants:
+        pop = pop[:-len(immigrants)] + immigrants
+    return sorted(pop, key = lambda i: i.fitness, reverse=True)
+
+
+def island(config, index, seed, pop_size, max_gen, outboxes, inbox, incoming, results, path=None):
+    """
+    Run the evolution of a single island, in its own process. Fitness is calculated in
+    this process, with batch_fitness when batched is set in the config
+
+    Parameters:
+        config (dict) : The settings, which the process is set up from
+        index (int) : The number of the island
+        seed (int) : The seed of its random number generators
+        pop_size (int) : The population size of the island
+        max_gen (int) : The number of generations to run for
+        outboxes, inbox, incoming : See migrate
+        results : A queue for the result, a tuple of the index, the best fitness of each
+                  generation, the final best member and the best member seen
+        path (str) : The file to log to, with the metrics written next to it, None -> no log
+    """
+    configure(config)
+    random.seed(seed)
+    np.random.seed(seed)
+    file = open(path,'w') if path else None
+    metrics_log = metrics.MetricsLog(os.path.splitext(path)[0] + ".metrics.jsonl") if path else None
+    pop = evolve.initialise(pop_size)
+    history = []
+    best = None
+    mcount = 0
+    for generation in range(max_gen):
+        rs = random.random()
+        if train.batched:
+            for item, f in zip(pop, train.batch_fitness([x.genome for x in pop], rs)):
+                item.fitness = f
+            pop = sorted(pop, key = lambda i: i.fitness, reverse=True)
+        else:
+            pop = sorted([evolve.assess_item(x, train.fitness, rs) for x in pop], key = lambda i: i.fitness, reverse=True)
+        history.append(pop[0].fitness)
+        if best is None or pop[0].fitness > best.fitness:
+            best = pop[0]
+        if file:
+            evolve.log_fitness(pop, generation, mcount, file, metrics=metrics_log)
+            mcount = 0
+
+        pop = evolve.sus(pop)
+        if train.batched:
+            children = evolve.make_children(pop)
+            pop, c, _ = evolve.replace_parents(pop, children, train.batch_fitness(children, rs))
+            mcount += c
+        else:
+            result = [evolve.mutate_item(x, train.fitness, rs) for x in pop]
+            pop = sorted([x[0] for x in result], key = lambda i: i.fitness, reverse=True)
+            mcount += sum(x[1] for x in result)
+
+        if (generation+1) % migration_interval == 0 and generation+1 < max_gen:
+            pop = migrate(pop, outboxes, inbox, incoming, migrants)
+
+    if file:
+        file.close()
+        metrics_log.close()
+    results.put((index, history, pop[0], best))
+
+
+def run(n, pop_size=100, max_gen=1, start=None):
+    """
+    Run n islands, each in its own process
+
+    Parameters:
+        n (int) : The number of islands
+        pop_size (int) : The population size of each island
+        max_gen (int) : The number of generations to run for
+        start (float) : The time stamp used to name the logs, None -> no logs
+
+    Return:
+        For each island, the best fitness of each generation, the final best member and the best member seen
+    """
+    destinations = neighbours(topology, n)
+    inboxes = [Queue() for _ in range(n)]
+    results = Queue()
+    processes = []
+    for i, seed in enumerate(replicates.seeds(train.seed, n)):
+        incoming = sum(i in d for d in destinations)
+        path = f"logs/{int(start)}_island{i}.txt" if start is not None else None
+        processes.append(Process(target=island, args=({**train.settings, "seed" : train.seed}, i, seed, pop_size, max_gen, [inboxes[j] for j in destinations[i]],
+                                                      inboxes[i], incoming, results, path)))
+    for p in processes:
+        p.start()
+    # The results have to be read before joining, or a process can block flushing its queue.
+    # An island that crashes never posts its result and leaves its neighbours waiting for
+    # migrants, so keep checking that every island is alive while waiting
+    out = []
+    while len(out) < len(processes):
+        try:
+            out.append(results.get(timeout=1))
+        except queue.Empty:
+            crashed = [i for i, p in enumerate(processes) if p.exitcode not in (None, 0)]
+            if crashed:
+                for p in processes:
+                    p.terminate()
+                    p.join()
+                raise RuntimeError(f"Island {crashed[0]} exited with code {processes[crashed[0]].exitcode}")
+    out = sorted(out, key = lambda r: r[0])
+    for p in processes:
+        p.join()
+    return [r[1:] for r in out]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: py ./islands.py config.json [islands]")
+        exit()
+    configure(sys.argv[1])
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else islands
+    print(f"Running {n} islands of {island_size} genomes for {train.generations} generations, {topology} topology, "
+          f"{migrants} migrants every {migration_interval} generations, seed {train.seed}")
+    start = time.time()
+    results = run(n, island_size, train.generations, start)
+    history = np.max([r[0] for r in results], axis=0)
+    best = max((r[2] for r in results), key = lambda i: i.fitness)
+    last = max((r[1] for r in results), key = lambda i: i.fitness)
+    for generation in range(0, len(history), 20):
+        print(f"{generation:4d} - Best fitness : {history[generation]:.3f}")
+    print(f"Last fitness: {last.fitness}")
+    print(f"Best fitness: {best.fitness}")
+
+    with open(f"models/last_{int(start)}_islands.pkl",'wb') as g:
+        pickle.dump(last.genome,g)
+    with open(f"models/best_{int(start)}_islands.pkl",'wb') as g:
+        pickle.dump(best.genome,g)
+    print(f"Finished training in {time.time() - start} seconds")
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,9 @@ def quickClip(minV,maxV,value):
     """
     return max(minV,min(maxV,value))
 
+# Motor functions return the distance moved in one timestep. Their speeds are given
+# per unit of time, so all of them are scaled by line_location.timestep
+
 def discreteMotor(val):
     """
     A motor function that assign -0.01, 0 or 0.01 based on a threshold
@@ -29,32 +32,56 @@ def discreteMotor(val):
         -0.01, 0 or 0.01
     """
     if val < 0.25:
-        return -0.01
+        return -0.01 * line_location.timestep
     elif val > 0.75: 
-        return 0.01
+        return 0.01 * line_location.timestep
     else:
         return 0
 
 def clippedMotor1(val):
-    return quickClip(-0.01,0.01,(val-0.5)/50)
+    return quickClip(-0.01,0.01,(val-0.5)/50) * line_location.timestep
 
 def clippedMotor2(val):
-    return quickClip(-0.01,0.01,(val-1)/50)
+    return quickClip(-0.01,0.01,(val-1)/50) * line_location.timestep
 
 def clippedMotor3(val):
-    return quickClip(-0.01,0.01,val-0.59)
+    return quickClip(-0.01,0.01,val-0.59) * line_location.timestep
 
 def sigmoidMotor(val):
-    return (expit(val)-0.5)/50 
+    return (expit(val)-0.5)/50 * line_location.timestep
 
 def tanhMotor(val):
-    return (tanh(val)-0.5)/50
+    return (tanh(val)-0.5)/50 * line_location.timestep
 
 def camposMotor(val):
     return (2 * (val - 0.5))  * 0.01 * line_location.timestep
 
 motors = {"discreteMotor":discreteMotor, "clippedMotor1" : clippedMotor1, "clippedMotor2" : clippedMotor2, "clippedMotor3" : clippedMotor3, "sigmoidMotor" : sigmoidMotor, "tanhMotor" : tanhMotor, "camposMotor":camposMotor}
 motorFunction = clippedMotor1
+
+# Vectorized versions of the motor functions above, which act on arrays of outputs
+def batchDiscreteMotor(val):
+    return np.where(val < 0.25, -0.01, np.where(val > 0.75, 0.01, 0.0)) * line_location.timestep
+
+def batchClippedMotor1(val):
+    return np.clip((val-0.5)/50,-0.01,0.01) * line_location.timestep
+
+def batchClippedMotor2(val):
+    return np.clip((val-1)/50,-0.01,0.01) * line_location.timestep
+
+def batchClippedMotor3(val):
+    return np.clip(val-0.59,-0.01,0.01) * line_location.timestep
+
+def batchSigmoidMotor(val):
+    return (expit(val)-0.5)/50 * line_location.timestep
+
+def batchTanhMotor(val):
+    return (np.tanh(val)-0.5)/50 * line_location.timestep
+
+def batchCamposMotor(val):
+    return (2 * (val - 0.5))  * 0.01 * line_location.timestep
+
+batchMotors = {"discreteMotor":batchDiscreteMotor, "clippedMotor1" : batchClippedMotor1, "clippedMotor2" : batchClippedMotor2, "clippedMotor3" : batchClippedMotor3, "sigmoidMotor" : batchSigmoidMotor, "tanhMotor" : batchTanhMotor, "camposMotor":batchCamposMotor}
 class line_location():
     """
     The class representing the 1D agent game. The task has two agents, a sender and 
@@ -66,6 +93,7 @@ class line_location():
         receiverPos (float) : The starting location of the receiver
         goal (float) : The location of the endpoint. 
     """
+    # The time covered by each step, set from "timestep" in the config
     timestep = 1
 
     def __init__(self,senderPos=None,receiverPos=None,goal=None):
@@ -143,7 +171,7 @@ class line_location():
                 self.touches += 1
         
         if contactSensor and self.t > 150:
-            self.ctime += 1 # Remember this will be counted twice
+            self.ctime += self.timestep # Remember this will be counted twice
         if isSender:
             targetSensor = abs(self.senderPos - self.goal)
             return [contactSensor,self.senderPos,targetSensor]
@@ -199,6 +227,105 @@ class line_location():
         # else:
         #     return 0
 
+class BatchLineLocation():
+    """
+    Many independent copies of the line_location game held in arrays, so that
+    thousands of trials can be stepped at once. The motor function used is the
+    vectorized version of the current motorFunction.
+
+    Parameters:
+        senderPos (np.array(float)) : The starting location of each sender
+        receiverPos (np.array(float)) : The starting location of each receiver
+        goal (np.array(float)) : The location of each endpoint
+        shape (tuple(int)) : The shape of the batch, if the positions need to be broadcast
+    """
+
+    def __init__(self,senderPos,receiverPos,goal,shape=None):
+        senderPos, receiverPos, goal = np.broadcast_arrays(senderPos,receiverPos,goal)
+        if shape == None:
+            shape = goal.shape
+        self.shape = tuple(shape)
+        self.senderPos = np.broadcast_to(senderPos,self.shape).astype(np.float64)
+        self.receiverPos = np.broadcast_to(receiverPos,self.shape).astype(np.float64)
+        self.goal = np.broadcast_to(goal,self.shape).astype(np.float64)
+        self.t = 0
+        self.timestep = line_location.timestep
+        # ctime is a time, so it is only a whole number for whole timesteps
+        self.ctime = np.zeros(self.shape,dtype=np.int64 if float(self.timestep).is_integer() else np.float64)
+        self.ctimeStep = self.ctime.dtype.type(2 * self.timestep) # Counted twice, as in line_location
+        self.touches = np.zeros(self.shape,dtype=np.int64)
+        self.prevcon = np.ones(self.shape,dtype=bool)
+        self.contact = np.empty(self.shape,dtype=bool)
+        self.motor = batchMotors[motorFunction.__name__]
+
+    def step(self, senderOutput=0, receiverOutput=0):
+        """
+        Move every game ahead a single timestep
+
+        Parameters:
+            senderOutput (np.array(float)) : The raw output of each sender CTRNN
+            receiverOutput (np.array(float)) : The raw output of each receiver CTRNN
+        """
+        self.t += self.timestep
+        self.senderPos += self.motor(senderOutput)
+        np.clip(self.senderPos,0,0.3,out=self.senderPos)
+        self.receiverPos += self.motor(receiverOutput)
+
+    def getState(self,out=None):
+        """
+        Gather the sensor values for both agents of every game. This has the same
+        effect on touches and ctime as calling line_location.getState for the sender
+        and then the receiver
+
+        Parameters:
+            out (np.array(float)) : An optional array of shape (*shape, 2, 3) to write into
+
+        Return:
+            An array of shape (*shape, 2, 3), where [..., 0, :] are the sender sensors
+            and [..., 1, :] are the receiver sensors
+        """
+        if out is None:
+            out = np.empty(self.shape + (2,3))
+        contact = self.contactSensor()
+
+        self.touches += contact & ~self.prevcon
+        self.prevcon[...] = contact
+        if self.t > 150:
+            self.ctime += self.ctimeStep * contact
+
+        out[...,0,0] = contact
+        out[...,0,1] = self.senderPos
+        np.subtract(self.senderPos,self.goal,out=out[...,0,2])
+        np.abs(out[...,0,2],out=out[...,0,2])
+        out[...,1,0] = contact
+        out[...,1,1] = self.receiverPos
+        out[...,1,2] = -1
+        return out
+
+    def contactSensor(self):
+        """
+        Return:
+            A boolean array, true where the sender and receiver are in contact
+        """
+        np.less_equal(np.abs(self.senderPos - self.receiverPos),0.4,out=self.contact)
+        return self.contact
+
+    def getLoggingData(self):
+        """
+        Return:
+        A tuple containing the positions of both agents and the current value for T
+        """
+        return (self.receiverPos, self.senderPos, self.t)
+
+    def fitness(self):
+        """
+        The fitness of every game, as in line_location.fitness
+
+        Return:
+            An array of fitnesses, between 0 and 1
+        """
+        return np.maximum(1 - np.abs(self.receiverPos-self.goal),0)
+
 # Testing, 1 second movement
 def main():
     sim = line_location(1)
@@ -1,77 +1,37 @@
-import json
-import pickle
-import random
 import sys
-from multiprocessing import Pool, Value, cpu_count
-from statistics import mean, stdev
+from multiprocessing import Pool, cpu_count
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-import ctrnn
-import line_location
+import archive
+import configuration
+import sweep
 
-simulation_seconds = 3
-
-if len(sys.argv) < 3:
-    print("Usage: py ./meandistance.py config.json genome_name.pkl")
-    exit()
-
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
-simulation_seconds = settings.get("simulation_seconds",3)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
-
-def runtrial(c, goal):
-    dist = []
-    endpos = []
-    count = 0 
-    for sp,rp in [(sp, rp) for sp in np.arange(0,0.3,0.03) for rp in np.arange(0,0.3,0.03)]:
-        sim = line_location.line_location(senderPos=sp,receiverPos=rp,goal=goal)
-        time_const = line_location.line_location.timestep
-
-        sender = ctrnn.CTRNN(c,time_const)
-        receiver = ctrnn.CTRNN(c,time_const)
-
-        sender.reset()
-        receiver.reset()
-        # Run the given simulation for up to num_steps time steps.
-        while sim.t < simulation_seconds:
-            senderstate = sim.getState(True)
-            receiverstate = sim.getState(False)
-            act1 = sender.eulerStep(senderstate)
-            act2 = receiver.eulerStep(receiverstate)
-
-            senderOut = act1[0]
-            receiverOut = act2[0]
-
-            sim.step(senderOut,receiverOut)
-
-
-            # print(sim.getAsciiState())
-        dist.append(abs(sim.goal - sim.receiverPos))
-        endpos.append(sim.receiverPos)
-    return (mean(dist),stdev(dist),mean(endpos),stdev(endpos),goal)
-       
 
 def main():
+    if len(sys.argv) < 3:
+        print("Usage: py ./meandistance.py config.json genome_name.pkl")
+        exit()
+    import matplotlib.pyplot as plt
 
-
-    with open(sys.argv[2], 'rb') as f:
-        c = pickle.load(f)
+    settings = configuration.load(sys.argv[1])
+    configuration.apply(settings)
+    c = archive.loadModel(sys.argv[2])
 
     print(c)
 
-    with Pool(processes=cpu_count()) as pool:
-        tasks = [(c,goal) for goal in np.arange(0.5,1,0.01)]
-        results = pool.starmap(runtrial,tasks)
-
-    meandist = [result[0] for result in results]
-    meanerr = [result[1] for result in results]
-    endpos = [result[2] for result in results]
-    enderr = [result[3] for result in results]
-
-    goal = [result[4] for result in results]
+    goals = np.arange(0.5,1,0.01)
+    starts = np.arange(0,0.3,0.03)
+    with Pool(processes=cpu_count(), initializer=configuration.apply, initargs=(settings,)) as pool:
+        result = sweep.sweep(c,settings,{"goal" : goals, "sender" : starts, "receiver" : starts},pool=pool)
+
+    distances = result.collapse("distance",["goal"])
+    positions = result.collapse("receiverPos",["goal"])
+    meandist = distances.mean(axis=1)
+    meanerr = distances.std(axis=1,ddof=1)
+    endpos = positions.mean(axis=1)
+    enderr = positions.std(axis=1,ddof=1)
+    goal = goals
 
     fig, ax = plt.subplots(1,2)
     ax[0].errorbar(goal,meandist,yerr=meanerr,fmt="bo")
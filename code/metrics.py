@@ -0,0 +1,179 @@
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Per-generation metrics of a run, one JSON object per line with the same flat keys on
+# every line, written next to the text log as logs/<name>.metrics.jsonl. aggregate loads many
+# runs into one array per metric, of shape (runs, generations), for convergence curves
+# and percentiles across replicates.
+# Usage: py ./metrics.py logs/*.metrics.jsonl [metric] [out.png|out.npz]
+
+percentiles = (10, 25, 50, 75, 90)
+
+
+class MetricsLog():
+    """
+    A buffered writer of per-generation metrics
+
+    Parameters:
+        path (str) : The file to write to
+        resume (int) : When carrying on a run, the first generation still to be logged.
+                       Rows from this generation on are dropped, None -> start a new file
+        buffer (int) : The number of rows kept before writing
+    """
+    def __init__(self, path, resume=None, buffer=20):
+        self.path = path
+        self.buffer = buffer
+        self.rows = []
+        if resume is not None and os.path.exists(path):
+            with open(path,'r') as f:
+                kept = [line for line in f if json.loads(line)["generation"] < resume]
+            self.file = open(path,'w')
+            self.file.writelines(kept)
+        else:
+            self.file = open(path,'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, gen, fitness, ages, mcount, skipped=None, cache=None, surrogate=None, halving=None):
+        """
+        Add the metrics of one generation
+
+        Parameters:
+            gen (int) : The generation number
+            fitness, ages (np.array) : The fitness and age of every member of the population
+            mcount (int) : The number of accepted mutations
+            skipped (int) : The number of trials skipped by racing, if racing
+            cache (evolve.FitnessCache) : The fitness cache, if there is one
+            surrogate (evolve.Surrogate) : The surrogate, if there is one, for its accuracy
+                                           and the children it saved simulating in the last generation
+            halving (evolve.SuccessiveHalving) : The successive halving, if there is one, for the
+                                                 children promoted and the cost of the last generation
+        """
+        row = {"generation" : int(gen), "time" : time.time(), "size" : len(fitness),
+               "fitness_max" : float(fitness.max()), "fitness_min" : float(fitness.min()),
+               "fitness_mean" : float(fitness.mean()), "fitness_std" : float(fitness.std())}
+        for p, value in zip(percentiles, np.percentile(fitness, percentiles)):
+            row[f"fitness_p{p}"] = float(value)
+        row.update({"age_max" : int(ages.max()), "age_min" : int(ages.min()), "age_mean" : float(ages.mean()),
+                    "age_median" : float(np.median(ages)), "mutations" : int(mcount),
+                    "skipped" : None if skipped is None else int(skipped),
+                    "cache_hits" : None if cache is None else cache.hits,
+                    "cache_misses" : None if cache is None else cache.misses,
+                    "surrogate_correlation" : None if surrogate is None or np.isnan(surrogate.correlation) else surrogate.correlation,
+                    "surrogate_gain_correlation" : None if surrogate is None or np.isnan(surrogate.gainCorrelation) else surrogate.gainCorrelation,
+                    "surrogate_screened" : None if surrogate is None else int(surrogate.screened),
+                    "surrogate_simulated" : None if surrogate is None else surrogate.simulated,
+                    "surrogate_saved" : None if surrogate is None else surrogate.saved,
+                    "halving_promoted" : None if halving is None else halving.promoted,
+                    "halving_cost" : None if halving is None else float(halving.cost),
+                    "halving_saved" : None if halving is None else float(halving.saved)})
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        self.file.writelines(json.dumps(row) + "\n" for row in self.rows)
+        self.rows = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def load(paths):
+    """
+    Load many runs into one array for each metric
+
+    Parameters:
+        paths (list(str)) : The metrics files
+
+    Return:
+        The generations logged, and a dict of arrays of shape (runs, generations) for every
+        metric, with nan where a run has no row for a generation
+    """
+    runs = []
+    for path in paths:
+        with open(path,'r') as f:
+            runs.append([json.loads(line) for line in f])
+    generations = np.unique([row["generation"] for rows in runs for row in rows])
+    column = {gen: i for i, gen in enumerate(generations)}
+    names = [name for name in runs[0][0] if name != "generation"] if runs and runs[0] else []
+    out = {name: np.full((len(runs), len(generations)), np.nan) for name in names}
+    for r, rows in enumerate(runs):
+        index = [column[row["generation"]] for row in rows]
+        for name in names:
+            out[name][r, index] = [np.nan if row.get(name) is None else row[name] for row in rows]
+    return generations, out
+
+
+def summarise(values):
+    """
+    Parameters:
+        values (np.array(float)) : An array of shape (runs, generations)
+
+    Return:
+        A dict of the mean and each of percentiles across the runs, for every generation
+    """
+    summary = {"mean" : np.nanmean(values, axis=0)}
+    for p, row in zip(percentiles, np.nanpercentile(values, percentiles, axis=0)):
+        summary[f"p{p}"] = row
+    return summary
+
+
+def aggregate(paths, metric="fitness_max", out=None):
+    """
+    Print the spread of metric across runs, and optionally plot the convergence curves
+    or save every metric of every run as an npz file
+
+    Parameters:
+        paths (list(str)) : The metrics files
+        metric (str) : The metric to summarise
+        out (str) : A .png for the curves or a .npz for the arrays, None -> only print
+    """
+    generations, values = load(paths)
+    summary = summarise(values[metric])
+    print(f"{metric} across {len(paths)} runs")
+    print("generation " + " ".join(f"{name:>7s}" for name in summary))
+    for i in range(0, len(generations), max(1, len(generations) // 20)):
+        print(f"{generations[i]:10d} " + " ".join(f"{stat[i]:7.3f}" for stat in summary.values()))
+
+    if out is None:
+        return
+    if out.endswith(".npz"):
+        np.savez(out, generation=generations, runs=np.array(paths), **values)
+    else:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        ax.plot(generations, values[metric].T, color="grey", alpha=0.3, linewidth=0.5)
+        ax.fill_between(generations, summary["p10"], summary["p90"], alpha=0.3, label="10-90%")
+        ax.fill_between(generations, summary["p25"], summary["p75"], alpha=0.3, label="25-75%")
+        ax.plot(generations, summary["p50"], color="black", label="median")
+        ax.set(xlabel="Generation", ylabel=metric)
+        ax.legend()
+        fig.savefig(out)
+    print(f"Wrote {out}")
+
+
+def main():
+    paths = [path for arg in sys.argv[1:] if arg.endswith(".jsonl") for path in sorted(glob.glob(arg))]
+    rest = [arg for arg in sys.argv[1:] if not arg.endswith(".jsonl")]
+    if not paths:
+        print("Usage: py ./metrics.py logs/*.metrics.jsonl [metric] [out.png|out.npz]")
+        exit()
+    metric = next((arg for arg in rest if not arg.endswith((".png", ".npz", ".pdf", ".svg"))), "fitness_max")
+    out = next((arg for arg in rest if arg.endswith((".png", ".npz", ".pdf", ".svg"))), None)
+    aggregate(paths, metric, out)
+
+if __name__ == '__main__':
+    main()
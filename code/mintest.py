@@ -1,6 +1,4 @@
 from hashlib import new
-import json
-import pickle
 import random
 import sys
 from multiprocessing import Pool, Value, cpu_count
@@ -11,6 +9,8 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
 
+import archive
+import configuration
 import ctrnn
 import line_location
 
@@ -20,10 +20,9 @@ if len(sys.argv) < 3:
     print("Usage: py ./mintest.py config.json genome_name.pkl")
     exit()
 
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
+settings = configuration.load(sys.argv[1])
 simulation_seconds = settings.get("simulation_seconds",3)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+configuration.apply(settings)
 # ub = 126
 ub = 101
 lb = 50
@@ -48,8 +47,8 @@ def runtrial(c, goal):
         sim = line_location.line_location(senderPos=0,receiverPos=0,goal=g,goal2=g2)
 
         time_const = line_location.line_location.timestep
-        sender = ctrnn.CTRNN(c,time_const)
-        receiver = ctrnn.CTRNN(c,time_const)
+        sender = ctrnn.CTRNN(c,time_const,settings.get("integrator","euler"))
+        receiver = ctrnn.CTRNN(c,time_const,settings.get("integrator","euler"))
     
         sender.reset()
         receiver.reset()
@@ -58,8 +57,8 @@ def runtrial(c, goal):
         while sim.t < simulation_seconds:
             senderstate = sim.getState(True)
             receiverstate = sim.getState(False)
-            act1 = sender.eulerStep(senderstate)
-            act2 = receiver.eulerStep(receiverstate)
+            act1 = sender.step(senderstate)
+            act2 = receiver.step(receiverstate)
     
             senderOut = act1[0]
             receiverOut = act2[0]
@@ -80,13 +79,12 @@ def runtrial(c, goal):
     return fit
        
 def main():
-    with open(sys.argv[2], 'rb') as f:
-        c = pickle.load(f)
+    c = archive.loadModel(sys.argv[2])
 
     print(c)
 
 
-    with Pool(processes=cpu_count()) as pool:
+    with Pool(processes=cpu_count(), initializer=configuration.apply, initargs=(settings,)) as pool:
         tasks = [(c,goal) for goal in np.arange(lb,ub,1)]
         fit = pool.starmap(runtrial,tasks)
 
@@ -0,0 +1,154 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from multiprocessing import RawArray, Value, cpu_count
+
+# Opt-in instrumentation for training. The parent times each phase of a generation,
+# and the fitness functions sent to the pool are wrapped in Timed, which adds the time
+# each worker spends simulating, and the number of tasks and genomes it ran, to shared
+# counters. Every generation is written as one JSON line, so the time not spent
+# simulating (pickling, dispatch and idle workers) can be seen alongside the phases.
+
+# The counters of each worker, which are made by the Profiler and handed to the pool
+# workers through their initializer, so they are shared whether the workers are forked or spawned
+busy = None
+tasks = None
+evaluations = None
+_nextWorker = None
+_worker = 0
+
+
+def counters():
+    """
+    Return:
+        The shared counters, to be passed to init_worker in each worker
+    """
+    return busy, tasks, evaluations, _nextWorker
+
+
+def init_worker(shared):
+    """
+    The initializer of the pool, binding the counters and giving each worker its own slot in them
+
+    Parameters:
+        shared (tuple) : The counters, from counters()
+    """
+    global busy, tasks, evaluations, _nextWorker, _worker
+    busy, tasks, evaluations, _nextWorker = shared
+    with _nextWorker.get_lock():
+        _worker = _nextWorker.value % len(busy)
+        _nextWorker.value += 1
+
+
+class Timed():
+    """
+    A picklable wrapper of a fitness function that adds the time spent in it to the
+    counters of the worker it runs in
+
+    Parameters:
+        function (func) : A module level fitness function, or batch fitness function
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.function(*args, **kwargs)
+        busy[_worker] += time.perf_counter() - start
+        tasks[_worker] += 1
+        evaluations[_worker] += len(args[0]) if isinstance(args[0], list) else 1
+        return result
+
+
+class Profiler():
+    """
+    Records the timing of every generation of train.train as JSON lines
+
+    Parameters:
+        path (str) : The file the events are written to
+        generations (int) : The number of generations of the run, for the ETA
+        trialSteps (float) : The number of simulation steps in the evaluation of one genome, ntrials * steps
+        workers (int) : The number of processes in the pool
+    """
+    def __init__(self, path, generations, trialSteps, workers=None):
+        global busy, tasks, evaluations, _nextWorker
+        self.workers = workers or cpu_count()
+        busy = RawArray('d', self.workers)
+        tasks = RawArray('l', self.workers)
+        evaluations = RawArray('l', self.workers)
+        _nextWorker = Value('i', 0)
+
+        self.file = open(path, 'w')
+        self.generations = generations
+        self.trialSteps = trialSteps
+        self.phases = {}
+        self.count = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.event("start", generations=generations, trial_steps=trialSteps, workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def wrap(self, function):
+        return Timed(function)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a phase of the current generation, adding to it if it is entered more than once
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def event(self, name, **fields):
+        self.file.write(json.dumps({"event" : name, "time" : time.perf_counter() - self.start, **fields}) + "\n")
+
+    def generation(self, generation):
+        """
+        Write the event for a finished generation and reset the counters
+        """
+        now = time.perf_counter()
+        wall = now - self.last
+        self.last = now
+        self.count += 1
+        pooled = sum(self.phases.get(name, 0) for name in ("assess", "mutate"))
+        workerBusy = list(busy)
+        simulated = sum(evaluations)
+        self.event("generation", generation=generation, wall=wall, phases=self.phases,
+                   busy=workerBusy, tasks=list(tasks), evaluations=simulated,
+                   utilization=sum(workerBusy) / (self.workers * pooled) if pooled else 0,
+                   # Racing ends some trials early, so this counts every trial at full length
+                   trial_steps_per_second=simulated * self.trialSteps / wall if wall else 0,
+                   eta=(now - self.start) / self.count * (self.generations - generation - 1))
+        self.phases = {}
+        for counter in (busy, tasks, evaluations):
+            counter[:] = [0] * self.workers
+
+    def close(self):
+        if not self.file.closed:
+            self.event("end")
+            self.file.close()
+
+
+class Disabled():
+    """
+    Stands in for a Profiler when profiling is off, doing nothing
+    """
+    def wrap(self, function):
+        return function
+
+    def phase(self, name):
+        return nullcontext()
+
+    def generation(self, generation):
+        pass
+
+
+disabled = Disabled()
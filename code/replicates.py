@@ -0,0 +1,191 @@
+import os
+import pickle
+import random
+import sys
+import time
+
+import numpy as np
+
+import archive
+import evolve
+import metrics
+import train
+
+# Runs many independent evolutions side by side in one process pool. Every generation,
+# the evaluations of all the replicates are sent to the pool as one map, so the workers
+# stay busy even when a single population is too small to fill the machine. Each replicate
+# has its own random number generators, log file and output models.
+# Only the plain hill climber is supported, so racing, a surrogate, successive halving, other
+# optimizers, a screened initial population, shared memory and steady state are rejected.
+# Usage: py ./replicates.py config.json [replicates]
+
+
+class Replicate():
+    """
+    A single evolutionary run. Use it as a context manager around anything that draws
+    random numbers for this run, such as selection and mutation, to swap its own
+    random number generators in for the global ones
+
+    Parameters:
+        index (int) : The number of the replicate
+        seed (int) : The seed of its random number generators
+        pop_size (int) : The size of its population
+        path (str) : The file it logs to, with its metrics written next to it
+    """
+    def __init__(self, index, seed, pop_size, path):
+        self.index = index
+        self.seed = seed
+        self.random = random.Random(seed).getstate()
+        self.nprandom = np.random.RandomState(seed).get_state()
+        with self:
+            self.pop = evolve.initialise(pop_size)
+        self.best = None
+        self.mcount = 0
+        self.file = open(path,'w')
+        self.metrics = metrics.MetricsLog(os.path.splitext(path)[0] + ".metrics.jsonl")
+
+    def __enter__(self):
+        self.saved = (random.getstate(), np.random.get_state())
+        random.setstate(self.random)
+        np.random.set_state(self.nprandom)
+        return self
+
+    def __exit__(self, *args):
+        self.random = random.getstate()
+        self.nprandom = np.random.get_state()
+        random.setstate(self.saved[0])
+        np.random.set_state(self.saved[1])
+
+
+def seeds(seed, n):
+    """
+    Return:
+        n independent seeds derived from seed
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n)]
+
+
+def evaluate(pool, genomes, rss):
+    """
+    Evaluate a list of genomes for each replicate, interleaved in one pool map
+
+    Return:
+        A list of fitnesses for each replicate
+    """
+    jobs = list(zip(genomes, rss))
+    if train.batched:
+        return evolve.evaluate_many(jobs, pool, batch_fitness=train.batch_fitness)
+    return evolve.evaluate_many(jobs, pool, train.fitness)
+
+
+def check():
+    """
+    Raise a ValueError if the settings of train ask for anything but the plain hill climber,
+    as replicates only run its assess, sus and mutate loop
+    """
+    unsupported = [name for name, used in (("racing", evolve.racing),
+                                           ("surrogate", evolve.surrogate is not None),
+                                           ("successive_halving", evolve.halving is not None),
+                                           ("optimizer", train.optimizer != "hillclimber"),
+                                           ("initial_size", train.initial_size != train.population_size),
+                                           ("shared_memory", train.shared_memory),
+                                           ("steady_state", train.steady_state)) if used]
+    if unsupported:
+        raise ValueError(f"Replicates only run the plain hill climber, which does not support {', '.join(unsupported)}")
+
+
+def run(count, pop_size=100, max_gen=1, write_every=1, start=None):
+    """
+    Evolve count independent populations in lockstep, sharing one pool.
+    Children are made by each replicate in this process, with its own random number
+    generators, so a replicate gives the same result however many others run alongside it
+
+    Parameters:
+        count (int) : The number of replicates
+        pop_size (int) : The population size of each replicate
+        max_gen (int) : The number of generations to run for
+        write_every (int) : How often each replicate writes to its log
+        start (float) : The time stamp used to name the logs and models
+
+    Return:
+        The list of replicates
+    """
+    check()
+    if start is None:
+        start = time.time()
+    replicates = [Replicate(i, s, pop_size, f"logs/{int(start)}_{i}.txt") for i, s in enumerate(seeds(train.seed, count))]
+
+    with train.make_pool() as pool:
+        batch_start = time.time()
+        for generation in range(max_gen):
+            rss = []
+            for rep in replicates:
+                with rep:
+                    rss.append(random.random())
+
+            fitnesses = evaluate(pool, [[x.genome for x in rep.pop] for rep in replicates], rss)
+            for rep, fs in zip(replicates, fitnesses):
+                for item, f in zip(rep.pop, fs):
+                    item.fitness = f
+                rep.pop = sorted(rep.pop, key = lambda i: i.fitness, reverse=True)
+                if rep.best is None or rep.pop[0].fitness > rep.best.fitness:
+                    rep.best = rep.pop[0]
+                if write_every and generation % write_every == 0:
+                    evolve.log_fitness(rep.pop, generation, rep.mcount, rep.file, metrics=rep.metrics)
+                    rep.mcount = 0
+
+            if generation % 20 == 0:
+                best = [rep.pop[0].fitness for rep in replicates]
+                print(f"{generation:4d} - Best fitness : max:{max(best):.3f}, min:{min(best):.3f}, mean:{np.mean(best):.3f}")
+                print(f"Batch Time {time.time()-batch_start}")
+                batch_start = time.time()
+
+            children = []
+            for rep in replicates:
+                with rep:
+                    rep.pop = evolve.sus(rep.pop)
+                    children.append(evolve.make_children(rep.pop))
+
+            cfitnesses = evaluate(pool, children, rss)
+            for rep, cs, cfs in zip(replicates, children, cfitnesses):
+                rep.pop, c, _ = evolve.replace_parents(rep.pop, cs, cfs)
+                rep.mcount += c
+
+    for rep in replicates:
+        rep.file.close()
+        rep.metrics.close()
+    return replicates
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: py ./replicates.py config.json [replicates]")
+        exit()
+    train.configure(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else train.settings.get("replicates", 1)
+    print(f"Running {count} replicates of {train.population_size} genomes for {train.generations} generations, seed {train.seed}")
+
+    start = time.time()
+    replicates = run(count, train.population_size, train.generations, start=start)
+
+    names = []
+    genomes = []
+    for rep in replicates:
+        print(f"Replicate {rep.index} (seed {rep.seed}) - Last fitness: {rep.pop[0].fitness}, Best fitness: {rep.best.fitness}")
+        for kind, item in (("last", rep.pop[0]), ("best", rep.best)):
+            with open(f"models/{kind}_{int(start)}_{rep.index}.pkl",'wb') as g:
+                pickle.dump(item.genome,g)
+            names.append(f"{kind}_{int(start)}_{rep.index}")
+            genomes.append(item)
+
+    if train.settings.get("archive"):
+        path = train.settings["archive"]
+        if not os.path.exists(path):
+            archive.create(path, metadata={"config" : train.settings})
+        archive.append(path, [x.genome for x in genomes], names=names, fitnesses=[x.fitness for x in genomes],
+                       seeds=[rep.seed for rep in replicates for _ in range(2)], generations=[train.generations]*len(genomes))
+        print(f"Added {len(genomes)} genomes to {path}")
+    print(f"Finished {count} replicates in {time.time() - start} seconds")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import numpy as np
+from scipy.special import expit
+
+import ctrnn
+import line_location
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# The order of the motors and integrators used by the kernels
+motorCodes = {name: code for code, name in enumerate(line_location.motors)}
+integratorCodes = {name: code for code, name in enumerate(ctrnn.integrators)}
+
+
+def rollout(genome, task, config, backend=None):
+    """
+    Run a single trial of the sender/receiver game for one genome, with the sender
+    and receiver CTRNNs and the environment fused into one loop over preallocated buffers
+
+    Parameters:
+        genome (Genome) : The genome used by both the sender and the receiver
+        task (tuple(float)) : The sender start, receiver start and goal position
+        config (dict) : The settings, read for simulation_seconds, motor and integrator
+        backend (str) : "numba" or "numpy", defaults to numba when it is installed
+
+    Return:
+        A tuple containing the fitness, the final distance from the goal,
+        the number of touches and ctime
+    """
+    if backend == None:
+        backend = "numba" if njit is not None else "numpy"
+    sp, rp, goal = task
+    seconds = config.get("simulation_seconds",3)
+    motor = config.get("motor","clippedMotor1")
+    integrator = integratorCodes[config.get("integrator","euler")]
+    timestep = line_location.line_location.timestep
+
+    iWeights = np.zeros(genome.hiddenCount)
+    iWeights[:genome.inputsCount] = genome.inputWeights
+    args = (iWeights, np.asarray(genome.weights,dtype=np.float64), np.asarray(genome.biases,dtype=np.float64),
+            np.asarray(genome.rTaus,dtype=np.float64), float(sp), float(rp), float(goal), seconds, timestep)
+
+    if backend == "numba":
+        if njit is None:
+            raise ImportError("The numba backend needs numba to be installed")
+        rp, touches, ctime = _compiled_kernel()(*args, motorCodes[motor], integrator)
+    elif backend == "numpy":
+        rp, touches, ctime = _numpy_kernel(*args, line_location.motors[motor], integrator)
+    else:
+        raise ValueError(f"Unknown backend {backend}")
+
+    distance = abs(rp - goal)
+    # ctime is a time, so it is only a whole number for whole timesteps
+    ctime = int(ctime) if float(timestep).is_integer() else float(ctime)
+    return (max(1 - distance,0), distance, int(touches), ctime)
+
+
+def batch_rollout(genome, tasks, config):
+    """
+    Run many trials of the sender/receiver game for one genome at once, as a single
+    BatchCTRNN and BatchLineLocation holding every trial
+
+    Parameters:
+        genome (Genome) : The genome used by both the sender and the receiver
+        tasks (np.array(float)) : An array of shape (ntrials, 3) of sender starts, receiver starts and goal positions
+        config (dict) : The settings, read for simulation_seconds, motor and integrator
+
+    Return:
+        Arrays of the fitness, the final distance from the goal, the number of touches
+        and ctime of each trial, as returned by rollout
+    """
+    seconds = config.get("simulation_seconds",3)
+    sp, rp, goal = np.asarray(tasks,dtype=np.float64).reshape((-1,3)).T
+    sim = line_location.BatchLineLocation(senderPos=sp,receiverPos=rp,goal=goal,shape=(1,len(goal)))
+    sim.motor = line_location.batchMotors[config.get("motor","clippedMotor1")]
+    brain = ctrnn.BatchCTRNN([genome],(len(goal),2),sim.timestep,config.get("integrator","euler"))
+    inputs = np.empty((1,len(goal),2,brain.inputsCount))
+
+    while sim.t < seconds:
+        outputs = brain.step(sim.getState(inputs))
+        sim.step(outputs[:,:,0,0],outputs[:,:,1,0])
+
+    distance = np.abs(sim.receiverPos[0] - sim.goal[0])
+    return sim.fitness()[0], distance, sim.touches[0], sim.ctime[0]
+
+
+def _numpy_kernel(iWeights, weights, biases, rTaus, sp, rp, goal, seconds, timestep, motor, integrator):
+    """
+    The loop behind rollout, with the sender in row 0 and the receiver in row 1 of every buffer.
+    integrator is a code from integratorCodes
+    """
+    hidden = len(biases)
+    sTaus   = rTaus * timestep
+    decay   = np.exp(-sTaus)
+    states  = np.zeros((2,hidden))
+    outputs = expit(states + biases)
+    inputs  = np.zeros((2,hidden))
+    external = np.empty((2,hidden))
+    delta   = np.empty((2,hidden))
+    recurrent = np.empty((2,hidden))
+    inputs[1,2] = -1
+
+    def derivative(s):
+        return (external + expit(s + biases) @ weights - s) * rTaus
+
+    t = 0
+    touches = 0
+    ctime = 0
+    prevcon = True
+    while t < seconds:
+        contact = abs(sp - rp) <= 0.4
+        if contact and not prevcon:
+            touches += 1
+        prevcon = contact
+        if contact and t > 150:
+            ctime += 2 * timestep
+
+        inputs[0,0] = contact
+        inputs[0,1] = sp
+        inputs[0,2] = abs(sp - goal)
+        inputs[1,0] = contact
+        inputs[1,1] = rp
+
+        np.multiply(inputs, iWeights, out=external)
+        if integrator == 2:
+            k1 = derivative(states)
+            k2 = derivative(states + timestep/2 * k1)
+            k3 = derivative(states + timestep/2 * k2)
+            k4 = derivative(states + timestep * k3)
+            states += timestep/6 * (k1 + 2*k2 + 2*k3 + k4)
+        else:
+            np.matmul(outputs, weights, out=recurrent)
+            np.add(external, recurrent, out=delta)
+            if integrator == 0:
+                delta -= states
+                delta *= sTaus
+                states += delta
+            else:
+                states -= delta
+                states *= decay
+                states += delta
+        np.add(states, biases, out=outputs)
+        expit(outputs, out=outputs)
+
+        sp = line_location.quickClip(0,0.3,sp + motor(outputs[0,0]))
+        rp += motor(outputs[1,0])
+        t += timestep
+    return rp, touches, ctime
+
+
+_compiled = None
+
+def _compiled_kernel():
+    """
+    Compile the numba version of the rollout loop the first time it is needed
+
+    Return:
+        The compiled kernel
+    """
+    global _compiled
+    if _compiled is not None:
+        return _compiled
+
+    @njit(cache=True)
+    def motor(code, val, timestep):
+        if code == 0:
+            if val < 0.25:
+                return -0.01 * timestep
+            elif val > 0.75:
+                return 0.01 * timestep
+            return 0.0
+        elif code == 1:
+            return min(0.01,max(-0.01,(val-0.5)/50)) * timestep
+        elif code == 2:
+            return min(0.01,max(-0.01,(val-1)/50)) * timestep
+        elif code == 3:
+            return min(0.01,max(-0.01,val-0.59)) * timestep
+        elif code == 4:
+            return (1/(1+np.exp(-val))-0.5)/50 * timestep
+        elif code == 5:
+            return (np.tanh(val)-0.5)/50 * timestep
+        return (2 * (val - 0.5)) * 0.01 * timestep
+
+    @njit(cache=True)
+    def derivative(states, external, weights, biases, rTaus, out):
+        for a in range(states.shape[0]):
+            for j in range(states.shape[1]):
+                recurrent = 0.0
+                for i in range(states.shape[1]):
+                    recurrent += weights[i,j] / (1 + np.exp(-(states[a,i] + biases[i])))
+                out[a,j] = (external[a,j] + recurrent - states[a,j]) * rTaus[j]
+
+    @njit(cache=True)
+    def kernel(iWeights, weights, biases, rTaus, sp, rp, goal, seconds, timestep, code, integrator):
+        hidden = biases.shape[0]
+        sTaus   = rTaus * timestep
+        decay   = np.exp(-sTaus)
+        states  = np.zeros((2,hidden))
+        outputs = np.empty((2,hidden))
+        inputs  = np.zeros((2,hidden))
+        external = np.empty((2,hidden))
+        k1 = np.empty((2,hidden))
+        k2 = np.empty((2,hidden))
+        k3 = np.empty((2,hidden))
+        k4 = np.empty((2,hidden))
+        for a in range(2):
+            for j in range(hidden):
+                outputs[a,j] = 1/(1+np.exp(-biases[j]))
+        inputs[1,2] = -1
+
+        t = 0.0
+        touches = 0
+        ctime = 0.0
+        prevcon = True
+        while t < seconds:
+            contact = abs(sp - rp) <= 0.4
+            if contact and not prevcon:
+                touches += 1
+            prevcon = contact
+            if contact and t > 150:
+                ctime += 2 * timestep
+
+            inputs[0,0] = contact
+            inputs[0,1] = sp
+            inputs[0,2] = abs(sp - goal)
+            inputs[1,0] = contact
+            inputs[1,1] = rp
+            for a in range(2):
+                for j in range(hidden):
+                    external[a,j] = inputs[a,j] * iWeights[j]
+
+            if integrator == 2:
+                derivative(states, external, weights, biases, rTaus, k1)
+                derivative(states + timestep/2 * k1, external, weights, biases, rTaus, k2)
+                derivative(states + timestep/2 * k2, external, weights, biases, rTaus, k3)
+                derivative(states + timestep * k3, external, weights, biases, rTaus, k4)
+                for a in range(2):
+                    for j in range(hidden):
+                        states[a,j] += timestep/6 * (k1[a,j] + 2*k2[a,j] + 2*k3[a,j] + k4[a,j])
+            else:
+                for a in range(2):
+                    for j in range(hidden):
+                        recurrent = 0.0
+                        for i in range(hidden):
+                            recurrent += outputs[a,i] * weights[i,j]
+                        delta = external[a,j] + recurrent
+                        if integrator == 0:
+                            states[a,j] += sTaus[j] * (delta - states[a,j])
+                        else:
+                            states[a,j] = delta + (states[a,j] - delta) * decay[j]
+            for a in range(2):
+                for j in range(hidden):
+                    outputs[a,j] = 1/(1+np.exp(-(states[a,j] + biases[j])))
+
+            sp = min(0.3,max(0.0,sp + motor(code, outputs[0,0], timestep)))
+            rp += motor(code, outputs[1,0], timestep)
+            t += timestep
+        return rp, touches, ctime
+
+    _compiled = kernel
+    return _compiled
@@ -0,0 +1,203 @@
+import itertools
+from multiprocessing import cpu_count
+
+import numpy as np
+
+import ctrnn
+import line_location
+
+# Sweeps run the sender/receiver game for every combination of a set of axes as one
+# batched simulation. The environment axes are "sender" and "receiver" (the starting
+# positions) and "goal", while "simulation_seconds" records every game at several
+# lengths in a single run and "genome" runs several genomes side by side. The settings
+# axes "timestep", "motor" and "integrator" change how every game is simulated, so each
+# combination of their values is run as a batch of its own.
+
+environment = ("sender", "receiver", "goal")
+settingsAxes = ("timestep", "motor", "integrator")
+fieldNames = ("receiverPos", "senderPos", "distance", "fitness", "touches", "ctime")
+
+
+class SweepResult():
+    """
+    The result of a sweep, a labeled N-dimensional array for each field
+
+    Parameters:
+        axes (dict) : The values of each axis, in the order of the dimensions of the fields
+        fields (dict) : An array for each of receiverPos (the final position of the receiver),
+                        senderPos, distance, fitness, touches and ctime
+    """
+    def __init__(self, axes, fields):
+        self.axes = axes
+        self.fields = fields
+
+    @property
+    def names(self):
+        return list(self.axes)
+
+    @property
+    def shape(self):
+        return tuple(len(values) for values in self.axes.values())
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def collapse(self, field, keep):
+        """
+        Gather every game for each combination of the kept axes
+
+        Parameters:
+            field (str) : The field to use
+            keep (list(str)) : The axes to keep, in the order they should appear
+
+        Return:
+            An array of shape (*kept axis lengths, games), so statistics can be taken over the last axis
+        """
+        order = [self.names.index(name) for name in keep]
+        rest = [i for i in range(len(self.names)) if i not in order]
+        values = np.transpose(self.fields[field], order + rest)
+        return values.reshape(values.shape[:len(keep)] + (-1,))
+
+
+def grid(axes, fixed=None):
+    """
+    Split axes into swept values and fixed values
+
+    Parameters:
+        axes (dict) : The values of each axis, scalars are fixed rather than swept
+
+    Return:
+        An ordered dict of the swept axes as arrays, and a dict of the fixed values
+    """
+    swept = {}
+    fixed = dict(fixed or {})
+    for name, values in axes.items():
+        if name in ("genome", "motor", "integrator") and not isinstance(values, str):
+            swept[name] = list(values)
+        elif name not in ("genome", "motor", "integrator") and np.ndim(values) > 0:
+            swept[name] = np.asarray(values,dtype=np.float64)
+        else:
+            fixed[name] = values
+    return swept, fixed
+
+
+def simulate(genomes, senderPos, receiverPos, goal, seconds, motor, integrator="euler", timestep=None):
+    """
+    Run one batch of games for every genome, recording the state each time the
+    simulation reaches one of the lengths in seconds
+
+    Parameters:
+        genomes (list(Genome)) : The genomes to be run
+        senderPos, receiverPos, goal (np.array(float)) : The starting positions and goal of each game
+        seconds (np.array(float)) : The simulation lengths to record, in increasing order
+        motor (str) : The name of the motor function
+        integrator (str) : The name of the integrator, see ctrnn.integrators
+        timestep (float) : The timestep of line_location while this batch runs, None -> leave it as it is
+
+    Return:
+        A dict of arrays of shape (genomes, games, lengths), one for each field
+    """
+    if timestep is not None:
+        previous = line_location.line_location.timestep
+        line_location.line_location.timestep = timestep
+        try:
+            return simulate(genomes, senderPos, receiverPos, goal, seconds, motor, integrator)
+        finally:
+            line_location.line_location.timestep = previous
+    n = len(goal)
+    sim = line_location.BatchLineLocation(senderPos=senderPos,receiverPos=receiverPos,goal=goal,shape=(len(genomes),n))
+    sim.motor = line_location.batchMotors[motor]
+    brains = ctrnn.BatchCTRNN(genomes,(n,2),sim.timestep,integrator)
+    inputs = np.empty((len(genomes),n,2,brains.inputsCount))
+    # ctime takes the type of sim.ctime, which is only a whole number for whole timesteps
+    dtypes = {"touches" : np.int64, "ctime" : sim.ctime.dtype}
+    out = {name: np.empty((len(genomes),n,len(seconds)),dtype=dtypes.get(name, np.float64)) for name in fieldNames}
+
+    def record(k):
+        out["receiverPos"][...,k] = sim.receiverPos
+        out["senderPos"][...,k] = sim.senderPos
+        out["distance"][...,k] = np.abs(sim.receiverPos - sim.goal)
+        out["fitness"][...,k] = sim.fitness()
+        out["touches"][...,k] = sim.touches
+        out["ctime"][...,k] = sim.ctime
+
+    k = 0
+    while k < len(seconds):
+        # Record every length that has been reached, as the loop in rollout stops once t >= seconds
+        while k < len(seconds) and sim.t >= seconds[k]:
+            record(k)
+            k += 1
+        if k == len(seconds):
+            break
+        outputs = brains.step(sim.getState(inputs))
+        sim.step(outputs[:,:,0,0],outputs[:,:,1,0])
+    return out
+
+
+def sweep(genome, config, axes, pool=None, chunk=4096):
+    """
+    Run the game for every combination of the values of axes
+
+    Parameters:
+        genome (Genome or list(Genome)) : The genome to be run, or a list of genomes
+                                          which adds a "genome" axis at the front
+        config (dict) : The settings, read for simulation_seconds, timestep, motor and integrator
+        axes (dict) : Values for "sender", "receiver", "goal" and optionally "simulation_seconds",
+                      "timestep", "motor" and "integrator", in the order the axes should appear.
+                      Scalars (or a single name) are held fixed, not swept
+        pool (multiprocessing.pool.Pool) : If given, chunks of games are run in parallel
+        chunk (int) : The most games simulated at once for each genome, chunks are smaller
+                      when needed to give every worker of the pool some work
+
+    Return:
+        A SweepResult
+    """
+    genomes = list(genome) if isinstance(genome, (list, tuple)) else [genome]
+    axes = dict(axes)
+    if isinstance(genome, (list, tuple)):
+        axes = {"genome": genomes, **axes}
+    swept, fixed = grid(axes, {"simulation_seconds": config.get("simulation_seconds",3), "timestep": config.get("timestep",1),
+                               "motor": config.get("motor","clippedMotor1"), "integrator": config.get("integrator","euler")})
+    for name in swept.keys() | fixed.keys():
+        if name not in environment + settingsAxes + ("simulation_seconds", "genome"):
+            raise ValueError(f"Unknown sweep axis {name}")
+    for name in environment:
+        if name not in swept and name not in fixed:
+            raise ValueError(f"Sweep needs a value for {name}")
+
+    # Games are laid out with the environment axes flattened, in the order they were given
+    env = [name for name in swept if name in environment]
+    mesh = np.meshgrid(*[swept[name] for name in env], indexing='ij')
+    values = {name: mesh[i].ravel() for i, name in enumerate(env)}
+    games = mesh[0].size if env else 1
+    for name in environment:
+        if name not in values:
+            values[name] = np.full(games, fixed[name], dtype=np.float64)
+
+    seconds = swept.get("simulation_seconds", np.array([fixed.get("simulation_seconds")],dtype=np.float64))
+    order = np.argsort(seconds)
+    # Every combination of the settings, in the order the axes were given, each with the same chunks of games
+    settings = [name for name in swept if name in settingsAxes]
+    combinations = [{**fixed, **dict(zip(settings, values))} for values in itertools.product(*[swept[name] for name in settings])]
+    if pool is not None:
+        chunk = max(1, min(chunk, -(-games * len(combinations) // cpu_count())))
+    starts = range(0, games, chunk)
+    tasks = [(genomes, values["sender"][i:i+chunk], values["receiver"][i:i+chunk], values["goal"][i:i+chunk], seconds[order],
+              c["motor"], c["integrator"], c["timestep"]) for c in combinations for i in starts]
+    results = pool.starmap(simulate, tasks) if pool is not None else [simulate(*task) for task in tasks]
+
+    # Put the dimensions back in the order the axes were given
+    internal = ["genome"] + settings + env + ["simulation_seconds"]
+    external = [name for name in swept]
+    shape = (len(genomes),) + tuple(len(swept[name]) for name in settings + env) + (len(seconds),)
+    fields = {}
+    for name in fieldNames:
+        field = np.stack([np.concatenate([r[name] for r in results[k:k+len(starts)]], axis=1)
+                          for k in range(0, len(results), len(starts))], axis=1)
+        field[...,order] = field.copy()
+        field = field.reshape(shape)
+        dropped = [i for i, axis in enumerate(internal) if axis not in swept]
+        field = field.reshape([n for i, n in enumerate(shape) if i not in dropped])
+        kept = [axis for axis in internal if axis in swept]
+        fields[name] = np.transpose(field, [kept.index(axis) for axis in external])
+    return SweepResult(swept, fields)
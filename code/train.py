@@ -1,3 +1,4 @@
+import copy
 import json
 import pickle
 import random
@@ -5,112 +6,521 @@ import statistics
 import sys
 import numpy as np
 import time
+from contextlib import nullcontext
 from multiprocessing import Pool, Value, cpu_count
 from multiprocessing.context import ProcessError
+import os
 from os import supports_effective_ids
 
+import archive
+import checkpoint
+import configuration
 import ctrnn
 import evolve
 import line_location
+import metrics
+import profiling
+import rollout
 
-if len(sys.argv) < 2:
-    print("Usage: train.py config.json")
-    exit()
+# The settings of training, set from a config by configure. Importing this module has no
+# side effects, so it can be used as a library and imported by spawned workers
+settings = {}
+elitism = 0
+generations = 1000
+ntrials = 20
+population_size = 96
+# The number of random genomes the first population is screened from
+initial_size = 96
+simulation_seconds = 3
+batched = False
+shared_memory = False
+steady_state = False
+evaluations = 2*generations*population_size
+integrator = "euler"
+seed = None
+checkpoint_path = "models/resume.pkl"
+checkpoint_every = 20
+time_budget = None
+# true, or the path of the file to write profiling events to
+profile = False
+# "hillclimber" for sus and beerMutate, or the name of one of evolve.optimizers
+optimizer = "hillclimber"
+optimizer_options = {}
 
-with open(sys.argv[1],'r') as config:
-    settings = json.load(config)
+aggregate_fitness = evolve.rank_reduce
+batch_aggregate_fitness = evolve.rank_reduce_batch
+maxfitness = aggregate_fitness([1]*ntrials)
+time_const = 1
 
-elitism = settings.get("elitism",0)
-generations = settings.get("generations", 1000)
-ntrials = settings.get("ntrials",20)
-population_size = settings.get("population_size",96)
-simulation_seconds = settings.get("simulation_seconds",3)
 
-evolve.mutationRate = settings.get("mutationRate",0.447)
-evolve.centerCrossing = settings.get("centerCrossing", False)
-line_location.motorFunction = line_location.motors[settings.get("motor","clippedMotor1")]
+def configure(config):
+    """
+    Set up training in this process, including the settings of evolve and line_location
 
+    Parameters:
+        config (dict or str) : The settings, or the path of a JSON file holding them
+    """
+    global settings, elitism, generations, ntrials, population_size, initial_size, simulation_seconds, batched, shared_memory, \
+           steady_state, evaluations, integrator, seed, checkpoint_path, checkpoint_every, time_budget, profile, \
+           optimizer, optimizer_options, maxfitness, time_const
+    settings = configuration.load(config)
+    elitism = settings.get("elitism",0)
+    generations = settings.get("generations", 1000)
+    ntrials = settings.get("ntrials",20)
+    population_size = settings.get("population_size",96)
+    initial_size = settings.get("initial_size", population_size)
+    simulation_seconds = settings.get("simulation_seconds",3)
+    batched = settings.get("batched", False)
+    shared_memory = settings.get("shared_memory", False)
+    steady_state = settings.get("steady_state", False)
+    evaluations = settings.get("evaluations", 2*generations*population_size)
 
-aggregate_fitness = evolve.rank_reduce
-maxfitness = aggregate_fitness([1]*ntrials)
-time_const = line_location.line_location.timestep
+    evolve.mutationRate = settings.get("mutationRate",0.447)
+    evolve.centerCrossing = settings.get("centerCrossing", False)
+    evolve.racing = settings.get("racing", False)
+    evolve.cache = evolve.FitnessCache(settings["fitness_cache"], settings) if settings.get("fitness_cache", 0) else None
+    configuration.apply(settings)
+    integrator = settings.get("integrator","euler")
+    seed = settings["seed"] if "seed" in settings else random.randrange(2**32)
+    checkpoint_path = settings.get("checkpoint", "models/resume.pkl")
+    checkpoint_every = settings.get("checkpoint_every", 20)
+    time_budget = settings.get("time_budget", None)
+    profile = settings.get("profile", False)
+    optimizer = settings.get("optimizer", "hillclimber")
+    optimizer_options = settings.get("optimizer_options", {})
+    if optimizer != "hillclimber" and optimizer not in evolve.optimizers:
+        raise ValueError(f"Unknown optimizer {optimizer}")
+    # true, or the options of evolve.Surrogate
+    surrogate = settings.get("surrogate", False)
+    if surrogate and (evolve.racing or shared_memory or steady_state or optimizer != "hillclimber"):
+        raise ValueError("The surrogate only screens the mutants of the hill climber, without racing, shared memory or steady state")
+    evolve.surrogate = evolve.Surrogate(**{"seed" : seed, **(surrogate if isinstance(surrogate, dict) else {})}) if surrogate else None
+    # true, or the rounds of screening as [trials, seconds] pairs where null is the full value, and the fraction promoted
+    halving = settings.get("successive_halving", False)
+    if halving is True:
+        halving = {}
+    if halving is not False and (evolve.racing or shared_memory or steady_state or optimizer != "hillclimber" or surrogate):
+        raise ValueError("Successive halving only evaluates the mutants of the hill climber, without racing, shared memory, steady state or a surrogate")
+    rungs = halving.get("rungs", [[max(1, ntrials // 4), None]]) if halving is not False else []
+    evolve.halving = evolve.SuccessiveHalving([(trials or ntrials, seconds or simulation_seconds) for trials, seconds in rungs],
+                                              halving.get("promote", 0.5), (ntrials, simulation_seconds)) if halving is not False else None
+
+    maxfitness = aggregate_fitness([1]*ntrials)
+    time_const = line_location.line_location.timestep
+
+
+def init_worker(config, counters=None):
+    """
+    The initializer of training pools, which sets up each worker from the config and the
+    profiling counters it is given rather than relying on it being forked from a configured process
+    """
+    configure(config)
+    if counters is not None:
+        profiling.init_worker(counters)
+
+
+def make_pool(profiled=False):
+    """
+    Return:
+        A pool of cpu_count() workers, each set up with the current settings
+    """
+    # The seed is fixed so the workers don't draw one of their own
+    return Pool(processes=cpu_count(), initializer=init_worker,
+                initargs=({**settings, "seed" : seed}, profiling.counters() if profiled else None))
+
+
+def make_trials(rs):
+    """
+    Generate the trials for a generation
 
+    Parameters:
+        rs (float) : The seed used to generate the trials
+
+    Return:
+        A list of ntrials (senderPos, receiverPos, goal) tuples
+    """
+    rng = random.Random(rs)
+    return [(rng.uniform(0,0.3), rng.uniform(0,0.3), rng.uniform(0.5,1)) for _ in range(ntrials)]
+
+
+def fitness(genome,rs,threshold=None,fidelity=None):
+    """
+    The fitness of a genome across ntrials randomly generated trials
+
+    Parameters:
+        genome (Genome) : The genome to be evaluated
+        rs (float) : The seed used to generate the trials
+        threshold (float) : If given, race against this fitness with evolve.race
+        fidelity (tuple) : If given, only the first trials of the trials are run, for seconds, see evolve.SuccessiveHalving
+
+    Return:
+        The normalised fitness, or the fitness and number of skipped trials when racing
+    """
+    if fidelity is not None:
+        trials, seconds = fidelity
+        return trial_fitness(genome,make_trials(rs)[:trials],threshold,seconds)
+    return trial_fitness(genome,make_trials(rs),threshold)
+
+
+def trial_fitness(genome,tasks,threshold=None,seconds=None):
+    """
+    The same as fitness, for trials that have already been generated, optionally simulated for fewer seconds
+    """
+    config = settings if seconds is None else {**settings, "simulation_seconds" : seconds}
+    if threshold is not None:
+        return evolve.race(lambda task: rollout.rollout(genome,task,config)[0], tasks, threshold, aggregate_fitness)
 
-def fitness(genome,rs):
     fitnesses = []
+    for task in tasks:
+        fitnesses.append(rollout.rollout(genome,task,config)[0])
 
-    random.seed(rs)
-    for sp, rp, goal in [(random.uniform(0,0.3), random.uniform(0,0.3), random.uniform(0.5,1)) for _ in range(ntrials)]:
-        sender = ctrnn.CTRNN(genome,time_const)
-        receiver = ctrnn.CTRNN(genome,time_const)
-        sim = line_location.line_location(senderPos=sp,receiverPos=rp, goal=goal)
+    return aggregate_fitness(fitnesses)/(maxfitness if len(tasks) == ntrials else aggregate_fitness([1]*len(tasks)))
 
-        # Run the given simulation for up to num_steps time steps.
-        fitness = 0.0
-        while sim.t < simulation_seconds:
-            senderOut   = sender.eulerStep(sim.getState(True))[0]
-            receiverOut = receiver.eulerStep(sim.getState(False))[0]
 
-            sim.step(senderOut,receiverOut)
+def batch_fitness(genomes,rs,fidelity=None):
+    """
+    The same as fitness, but every genome and trial is simulated together, with a
+    single BatchCTRNN holding both the sender and receiver of every trial and a
+    BatchLineLocation holding every game
 
-        fitness = sim.fitness()
+    Parameters:
+        genomes (List(Genome)) : The genomes to be evaluated
+        rs (float) : The seed used to generate the trials
+        fidelity (tuple) : If given, only the first trials of the trials are run, for seconds
 
+    Return:
+        A list containing the fitness of each genome
+    """
+    trials, seconds = fidelity if fidelity is not None else (ntrials, simulation_seconds)
+    sp, rp, goal = np.array(make_trials(rs)[:trials]).T
+    sim = line_location.BatchLineLocation(senderPos=sp,receiverPos=rp,goal=goal,shape=(len(genomes),trials))
+    brains = ctrnn.BatchCTRNN(genomes,(trials,2),time_const,integrator)
+    inputs = np.empty((len(genomes),trials,2,brains.inputsCount))
 
-        fitnesses.append(fitness)
+    while sim.t < seconds:
+        outputs = brains.step(sim.getState(inputs))
+        sim.step(outputs[:,:,0,0],outputs[:,:,1,0])
 
+    return list(batch_aggregate_fitness(sim.fitness())/(maxfitness if trials == ntrials else aggregate_fitness([1]*trials)))
 
-    return aggregate_fitness(fitnesses)/maxfitness
-    
 
-def train(pop_size=100, max_gen=1, write_every=1, file=None):
+def initial_population(pop_size, pool, fit, batch_fit):
+    """
+    The first population of training, of pop_size random genomes, which are the best of
+    initial_size random genomes when that is larger, see evolve.initialise_screened
+
+    Parameters:
+        pop_size (int) : The population size
+        pool (multiprocessing.pool.Pool) : A multiprocessing pool
+        fit, batch_fit (func) : The fitness functions, as wrapped for profiling
+
+    Return:
+        A list of Citizens
+    """
+    if initial_size <= pop_size:
+        return evolve.initialise(pop_size)
+    rs = random.random()
+    if batched:
+        evaluate = lambda genomes, fidelity: evolve.batch_evaluate(genomes, pool, batch_fit, rs, fidelity)
+    else:
+        evaluate = lambda genomes, fidelity: pool.starmap(fit, [(g,rs,None,fidelity) for g in genomes])
+    pop, screen = evolve.initialise_screened(initial_size, pop_size, evaluate)
+    print(f"Screened {initial_size} random genomes down to {pop_size}, for the cost of {screen.cost:.1f} full evaluations")
+    return pop
 
-    with Pool(processes=cpu_count()) as pool:
+
+def save_checkpoint(checkpointer, pop, best, file, deadline, metrics=None, **progress):
+    """
+    Hand a snapshot of training to the checkpointer. If the deadline has passed, wait for
+    it to be written and raise checkpoint.OutOfTime
+
+    Parameters:
+        checkpointer (checkpoint.Checkpointer) : Writes the checkpoint in the background
+        pop (list) : The population
+        best (Citizen) : The best member seen so far
+        file (file) : The log file, whose position is saved so it can be rewound on resume
+        deadline (float) : The time.time() to stop by, None -> no time budget
+        metrics (metrics.MetricsLog) : The metrics log, which is flushed so it is complete up to the checkpoint
+        progress : The counters needed to carry on training
+    """
+    if metrics is not None:
+        metrics.flush()
+    log, offset = None, None
+    if file != None:
+        file.flush()
+        log, offset = file.name, file.tell()
+    checkpointer.save(checkpoint.snapshot(pop, best, log=log, logOffset=offset, **progress))
+    if deadline is not None and time.time() >= deadline:
+        checkpointer.close()
+        raise checkpoint.OutOfTime(progress)
+
+
+def train(pop_size=100, max_gen=1, write_every=1, file=None, resume=None, checkpointer=None, deadline=None, profiler=None, metrics=None):
+
+    # Profiling wraps the fitness functions so the workers count their time
+    timer = profiler or profiling.disabled
+    fit, batch_fit, trial_fit = timer.wrap(fitness), timer.wrap(batch_fitness), timer.wrap(trial_fitness)
+    shared = evolve.SharedPopulation(pop_size, ntrials) if shared_memory else nullcontext()
+    with shared, make_pool(profiler is not None) as pool:
         rs = random.random()
         batch_start = time.time()
-        pop = evolve.initialise(pop_size)
         generation = 0
         mcount = 0
         mcount2 = 0
+        scount = 0
         best = None
         best_fit = -1
+        if resume is not None:
+            pop, best = checkpoint.restore(resume)
+            best_fit = best.fitness if best is not None else -1
+            generation, mcount, mcount2, scount = resume["generation"], resume["mcount"], resume["mcount2"], resume["scount"]
+            if resume.get("surrogate") is not None:
+                evolve.surrogate = resume["surrogate"]
+            # The cache holds the hit and miss counts that are logged
+            if resume.get("cache") is not None:
+                evolve.cache = resume["cache"]
+        else:
+            pop = initial_population(pop_size, pool, fit, batch_fit)
+        # Always make some progress before checkpointing, so a small time budget can't stall a run
+        first = generation
         while generation < max_gen:
+            if checkpointer is not None and generation != first and \
+               (generation % checkpoint_every == 0 or (deadline is not None and time.time() >= deadline)):
+                with timer.phase("checkpoint"):
+                    save_checkpoint(checkpointer, pop, best, file, deadline, metrics,
+                                    generation=generation, mcount=mcount, mcount2=mcount2, scount=scount,
+                                    surrogate=copy.deepcopy(evolve.surrogate), cache=copy.deepcopy(evolve.cache))
+
             rs = random.random()
-            pop = evolve.assess(pop, pool, fitness,rs)
+            with timer.phase("assess"):
+                if batched:
+                    pop = evolve.assess_batch(pop, pool, batch_fit, rs)
+                elif shared_memory:
+                    pop = evolve.assess_shared(pop, pool, shared, trial_fit, make_trials(rs))
+                else:
+                    pop = evolve.assess(pop, pool, fit,rs)
 
             if pop[0].fitness > best_fit:
                 best = pop[0]
                 best_fit = pop[0].fitness
 
-            if generation % 20 == 0 and file != None:
-                evolve.log_fitness(pop, generation, mcount2, None)
-                print(f"Batch Time {time.time()-batch_start}")
+            with timer.phase("log"):
+                if generation % 20 == 0 and file != None:
+                    evolve.log_fitness(pop, generation, mcount2, None)
+                    print(f"Batch Time {time.time()-batch_start}")
+                    batch_start = time.time()
+                    mcount2 = 0
+                    with open("models/checkpoint.pkl",'wb') as g:
+                        pickle.dump(pop[0].genome,g)
+
+                if write_every and generation % write_every==0:
+                    evolve.log_fitness(pop, generation, mcount, file, scount if evolve.racing else None, metrics)
+                    mcount = 0
+                    scount = 0
+
+            generation += 1
+            with timer.phase("sus"):
+                pop = evolve.sus(pop)
+            with timer.phase("mutate"):
+                if batched:
+                    pop, c, s = evolve.mutate_batch(pop, pool, batch_fit, rs)
+                elif shared_memory:
+                    pop, c, s = evolve.mutate_shared(pop, pool, shared, trial_fit, make_trials(rs))
+                else:
+                    pop, c, s = evolve.mutate(pop, pool, fit,rs)
+            mcount += c
+            scount += s
+            mcount2 += c
+            timer.generation(generation - 1)
+    
+    return pop[0], best
+
+
+def train_optimizer(pop_size=100, max_gen=1, write_every=1, file=None, resume=None, checkpointer=None, deadline=None, profiler=None, metrics=None):
+    """
+    Train with the evolve.Optimizer named by "optimizer" in the config, such as evolve.SepCMAES,
+    which proposes every generation. As in train, each generation is evaluated on the same trials
+
+    Parameters:
+        See train
+
+    Return:
+        The best member of the final generation, and the best seen during training
+    """
+    timer = profiler or profiling.disabled
+    fit, batch_fit = timer.wrap(fitness), timer.wrap(batch_fitness)
+    with make_pool(profiler is not None) as pool:
+        batch_start = time.time()
+        generation = 0
+        best = None
+        best_fit = -1
+        if resume is not None:
+            _, best = checkpoint.restore(resume)
+            best_fit = best.fitness if best is not None else -1
+            generation, search = resume["generation"], resume["optimizer"]
+        else:
+            search = evolve.optimizers[optimizer](pop_size, **optimizer_options)
+        first = generation
+        while generation < max_gen:
+            if checkpointer is not None and generation != first and \
+               (generation % checkpoint_every == 0 or (deadline is not None and time.time() >= deadline)):
+                with timer.phase("checkpoint"):
+                    # A copy, as the optimizer changes while the checkpoint is written
+                    save_checkpoint(checkpointer, pop, best, file, deadline, metrics,
+                                    generation=generation, optimizer=copy.deepcopy(search))
+
+            rs = random.random()
+            with timer.phase("ask"):
+                genomes = search.ask()
+            with timer.phase("assess"):
+                if batched:
+                    fitnesses = evolve.batch_evaluate(genomes, pool, batch_fit, rs)
+                else:
+                    fitnesses = pool.starmap(fit, [(g,rs) for g in genomes])
+            with timer.phase("tell"):
+                search.tell(genomes, fitnesses)
+            pop = search.population()
+
+            if pop[0].fitness > best_fit:
+                best = pop[0]
+                best_fit = pop[0].fitness
+
+            with timer.phase("log"):
+                if generation % 20 == 0 and file != None:
+                    evolve.log_fitness(pop, generation, 0, None)
+                    print(f"Batch Time {time.time()-batch_start}")
+                    batch_start = time.time()
+                    with open("models/checkpoint.pkl",'wb') as g:
+                        pickle.dump(pop[0].genome,g)
+
+                if write_every and generation % write_every==0:
+                    evolve.log_fitness(pop, generation, 0, file, None, metrics)
+
+            generation += 1
+            timer.generation(generation - 1)
+
+    return pop[0], best
+
+
+def train_steady_state(pop_size=100, max_evals=200, write_every=1, file=None, resume=None, checkpointer=None, deadline=None, metrics=None):
+    """
+    Train with evolve.steady_state, counting progress in evaluations rather than generations.
+    Each task evaluates a parent and a child, and the logs are written every pop_size
+    tasks, which is the same amount of work as one generation of train
+
+    Parameters:
+        pop_size (int) : The population size
+        max_evals (int) : The number of genome evaluations to run for
+        write_every (int) : How often to write to file, in units of pop_size tasks
+        file (file) : The file to log to
+        resume (dict) : A checkpoint to carry on from
+        checkpointer (checkpoint.Checkpointer) : Writes checkpoints every checkpoint_every*pop_size tasks
+        deadline (float) : The time.time() to checkpoint and stop by
+        metrics (metrics.MetricsLog) : Where the metrics of each logged generation are recorded
+
+    Return:
+        The final best member of the population, and the best seen during training
+    """
+    with make_pool() as pool:
+        batch_start = time.time()
+        tasks = 0
+        mcount = 0
+        mcount2 = 0
+        scount = 0
+        best = None
+        best_fit = -1
+        if resume is not None:
+            pop, best = checkpoint.restore(resume)
+            best_fit = best.fitness if best is not None else -1
+            tasks, mcount, mcount2, scount = resume["tasks"], resume["mcount"], resume["mcount2"], resume["scount"]
+            if resume.get("cache") is not None:
+                evolve.cache = resume["cache"]
+        else:
+            pop = evolve.assess(initial_population(pop_size, pool, fitness, batch_fitness), pool, fitness, random.random())
+        first = tasks
+        for pop, c, s in evolve.steady_state(pop, pool, fitness):
+            if checkpointer is not None and tasks != first and \
+               (tasks % (checkpoint_every*pop_size) == 0 or (deadline is not None and time.time() >= deadline)):
+                save_checkpoint(checkpointer, pop, best, file, deadline, metrics,
+                                tasks=tasks, mcount=mcount, mcount2=mcount2, scount=scount, cache=copy.deepcopy(evolve.cache))
+            tasks += 1
+            mcount += c
+            mcount2 += c
+            scount += s
+            if pop[0].fitness > best_fit:
+                best = evolve.Citizen(pop[0].genome,pop[0].fitness,pop[0].age)
+                best_fit = pop[0].fitness
+
+            if tasks % (20*pop_size) == 0 and file != None:
+                evolve.log_fitness(pop, 2*tasks, mcount2, None)
+                elapsed = time.time()-batch_start
+                print(f"Batch Time {elapsed}")
+                print(f"Evaluations per second {40*pop_size/elapsed:.1f}")
                 batch_start = time.time()
                 mcount2 = 0
                 with open("models/checkpoint.pkl",'wb') as g:
                     pickle.dump(pop[0].genome,g)
 
-            if write_every and generation % write_every==0:
-                evolve.log_fitness(pop, generation, mcount, file)
+            if write_every and tasks % (write_every*pop_size) == 0:
+                evolve.log_fitness(pop, 2*tasks, mcount, file, scount if evolve.racing else None, metrics)
                 mcount = 0
+                scount = 0
+
+            if 2*tasks >= max_evals:
+                break
 
-            generation += 1
-            pop = evolve.sus(pop)
-            pop, c = evolve.mutate(pop, pool, fitness,rs)
-            mcount += c
-            mcount2 += c
-    
     return pop[0], best
 
 
+def run(resume=False):
+    """
+    Train with the current settings, see configure, writing the logs and models
 
-def main():
-    print(f"Configuration is \n\tElitism : {elitism}\n\tNumber of generations : {generations}\n\tNumber of trials : {ntrials}\n\tPopulation size : {population_size}\n\tSimulation length {simulation_seconds} seconds\n\tMutation Rate : {evolve.mutationRate}\n\tCenter Crossing : {evolve.centerCrossing}\n\tMotor function : {settings.get('motor','clippedMotor1')}")
+    Parameters:
+        resume (bool) : Carry on from the checkpoint, if there is one
+
+    Return:
+        The final best member and the best member seen, or None if training stopped to stay within the time budget
+    """
+    global seed
+    state = None
+    if resume and os.path.exists(checkpoint_path):
+        state = checkpoint.load(checkpoint_path)
+        start, run_seed = state["start"], state["seed"]
+        # The seed of the run, which configure draws afresh when the config has none
+        seed = state["seed"]
+        print(f"Resuming from {checkpoint_path}")
+    else:
+        start, run_seed = time.time(), seed
+        random.seed(seed)
+        np.random.seed(seed)
+    job_start = time.time()
+    deadline = job_start + time_budget if time_budget else None
 
-    start = time.time()
-    path = f"logs/{int(start)}.txt"
-    with open(path,'w') as f:
-        print(f"Logs are in {path}")
-        last, best = train(population_size,generations,file=f)
+    path = state["log"] if state and state["log"] else f"logs/{int(start)}.txt"
+    # Rows of the metrics log after the checkpoint are dropped, as the text log is rewound
+    resumed = None if state is None else state["generation"] if "generation" in state else 2*state["tasks"]
+    with open(path,'r+' if state else 'w') as f, checkpoint.Checkpointer(checkpoint_path, {"start" : start, "seed" : run_seed}) as checkpointer, \
+         metrics.MetricsLog(os.path.splitext(path)[0] + ".metrics.jsonl", resumed) as metrics_log:
+        if state:
+            f.seek(state["logOffset"])
+            f.truncate()
+        print(f"Logs are in {path} and {metrics_log.path}")
+        try:
+            if steady_state:
+                last, best = train_steady_state(population_size,evaluations,file=f,resume=state,checkpointer=checkpointer,deadline=deadline,metrics=metrics_log)
+            else:
+                profiler = None
+                if profile:
+                    profile_path = profile if isinstance(profile, str) else f"logs/{int(start)}_profile.jsonl"
+                    profiler = profiling.Profiler(profile_path, generations, ntrials * simulation_seconds / time_const)
+                    print(f"Profiling events are in {profile_path}")
+                trainer = train if optimizer == "hillclimber" else train_optimizer
+                with profiler or nullcontext():
+                    last, best = trainer(population_size,generations,file=f,resume=state,checkpointer=checkpointer,deadline=deadline,profiler=profiler,metrics=metrics_log)
+        except checkpoint.OutOfTime as e:
+            print(f"Stopped to stay within the time budget at {e}, continue with --resume")
+            return None
         print(f"Last fitness: {last.fitness}")
         print(f"Best fitness: {best.fitness}")
 
@@ -118,7 +528,26 @@ def main():
             pickle.dump(last.genome,g)
         with open("models/best_genome.pkl",'wb') as g:
             pickle.dump(best.genome,g)
-    print(f"Finished training in {time.time() - start} seconds")
+
+        if settings.get("archive"):
+            if not os.path.exists(settings["archive"]):
+                archive.create(settings["archive"], metadata={"config" : settings})
+            archive.append(settings["archive"], [last.genome, best.genome], names=[f"last_{int(start)}", f"best_{int(start)}"],
+                           fitnesses=[last.fitness, best.fitness], seeds=[run_seed, run_seed],
+                           generations=[evaluations if steady_state else generations]*2)
+            print(f"Added last_{int(start)} and best_{int(start)} to {settings['archive']}")
+    print(f"Finished training in {time.time() - job_start} seconds")
+    return last, best
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: train.py config.json [--resume]")
+        exit()
+    configure(sys.argv[1])
+    print(f"Configuration is \n\tElitism : {elitism}\n\tNumber of generations : {generations}\n\tNumber of trials : {ntrials}\n\tPopulation size : {population_size}\n\tInitial size : {initial_size}\n\tSimulation length {simulation_seconds} seconds\n\tMutation Rate : {evolve.mutationRate}\n\tCenter Crossing : {evolve.centerCrossing}\n\tMotor function : {settings.get('motor','clippedMotor1')}\n\tBatched : {batched}\n\tRacing : {evolve.racing}\n\tShared memory : {shared_memory}\n\tSteady state : {steady_state}\n\tFitness cache : {settings.get('fitness_cache',0)}\n\tOptimizer : {optimizer}\n\tSurrogate : {settings.get('surrogate',False)}\n\tSuccessive halving : {settings.get('successive_halving',False)}\n\tSeed : {seed}")
+
+    run("--resume" in sys.argv[2:])
 
 if __name__ == '__main__':
     main()
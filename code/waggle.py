@@ -0,0 +1,96 @@
+import importlib
+import sys
+
+# The library API and the single command line entry point. Only the standard library is
+# imported here, and each function or subcommand imports what it needs when it runs, so
+# starting up, and spawning workers that import this module, stays cheap and plotting
+# libraries are only loaded by the subcommands that plot.
+#
+#     import waggle
+#     last, best = waggle.train("configurations/true_campos.json")
+#     print(waggle.evaluate(best.genome, "configurations/true_campos.json", 2500))
+#
+# Usage: py ./waggle.py <command> [arguments of the command]
+
+# The module run by each subcommand, whose main reads the rest of the command line
+commands = {"train" : "train",
+            "evaluate" : "evaluate",
+            "sweep" : "meandistance",
+            "test" : "test",
+            "fixedpoint" : "fixedpoint",
+            "mintest" : "mintest",
+            "animate" : "animate",
+            "replicates" : "replicates",
+            "islands" : "islands",
+            "archive" : "archive",
+            "metrics" : "metrics",
+            "bench" : "bench",
+            "bench-islands" : "bench_islands",
+            "bench-integrators" : "bench_integrators"}
+
+
+def train(config, resume=False):
+    """
+    Train a population, writing the logs and models as train.py does
+
+    Parameters:
+        config (dict or str) : The settings, or the path of a JSON file holding them
+        resume (bool) : Carry on from the checkpoint, if there is one
+
+    Return:
+        The final best member and the best member seen, or None if training stopped to stay within the time budget
+    """
+    import train as training
+    training.configure(config)
+    return training.run(resume)
+
+
+def evaluate(model, config, ntrials, pool=None):
+    """
+    Run a genome on ntrials random trials, see evaluate.evaluate
+
+    Parameters:
+        model (Genome or str) : The genome, or a model path as taken by archive.loadModel
+    """
+    import archive
+    import evaluate as evaluation
+    if isinstance(model, str):
+        model = archive.loadModel(model)
+    return evaluation.evaluate(model, config, ntrials, pool)
+
+
+def sweep(genome, config, axes, processes=None):
+    """
+    Run the game for every combination of the values of axes, see sweep.sweep
+
+    Parameters:
+        processes (int) : The number of worker processes, 1 -> run in this process
+
+    Return:
+        A sweep.SweepResult
+    """
+    from multiprocessing import Pool, cpu_count
+
+    import configuration
+    import sweep as sweeps
+    settings = configuration.load(config)
+    configuration.apply(settings)
+    if processes == 1:
+        return sweeps.sweep(genome, settings, axes)
+    with Pool(processes=processes or cpu_count(), initializer=configuration.apply, initargs=(settings,)) as pool:
+        return sweeps.sweep(genome, settings, axes, pool=pool)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: py ./waggle.py <command> [arguments]\nCommands: " + ", ".join(commands))
+        exit()
+    name = commands[sys.argv[1]]
+    sys.argv = [f"{name}.py"] + sys.argv[2:]
+    # Scripts without a main run when they are imported
+    module = importlib.import_module(name)
+    if hasattr(module, "main"):
+        module.main()
+
+if __name__ == '__main__':
+    main()